@@ -0,0 +1,87 @@
+"""
+背景色を多用したレイアウトのエンコード速度を計測するベンチマーク。
+変更前後のリビジョンで実行し、fpsを比較する。
+
+    $ python benchmarks/background_graph.py [scene_count]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from os import path
+
+import ffmpeg
+
+sys.path.append(path.join(path.dirname(path.dirname(__file__)), "src"))
+
+from converter import convert_video  # noqa: E402
+from xml_parser import parsing_vsml  # noqa: E402
+
+FPS = 30
+SCENE_SECOND = 1
+COLORS = ["#003366", "#336699", "#ff9900", "#ffffff", "#202020"]
+
+
+def create_document(scene_count: int, image_path: str) -> str:
+    scenes = []
+    for index in range(scene_count):
+        colors = [
+            COLORS[(index + offset) % len(COLORS)] for offset in range(4)
+        ]
+        scenes.append(
+            """
+      <prl style="duration: {second}s; background-color: {0}">
+        <seq style="background-color: {1}">
+          <prl style="duration: {second}s; background-color: {2}">
+            <img src="{image}" style="width: 160px" />
+          </prl>
+        </seq>
+        <prl style="background-color: {3}; margin-left: 320px">
+          <img src="{image}" style="width: 160px" />
+          <img src="{image}" style="width: 80px; margin-left: 200px" />
+        </prl>
+      </prl>""".format(
+                *colors, second=SCENE_SECOND, image=image_path
+            )
+        )
+    return """<?xml version="1.0" encoding="UTF-8"?>
+<vsml>
+  <cont resolution="1280x720" fps="{}">
+    <seq>{}
+    </seq>
+  </cont>
+</vsml>
+""".format(
+        FPS, "".join(scenes)
+    )
+
+
+def main() -> None:
+    scene_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = os.path.join(tmp_dir, "image.png")
+        ffmpeg.input("testsrc=s=320x240", f="lavfi").output(
+            image_path, vframes=1
+        ).run(quiet=True)
+        vsml_path = os.path.join(tmp_dir, "layout.vsml")
+        with open(vsml_path, "w") as f:
+            f.write(create_document(scene_count, image_path))
+
+        vsml_data = parsing_vsml(vsml_path, True)
+        start = time.perf_counter()
+        convert_video(
+            vsml_data, os.path.join(tmp_dir, "video.mp4"), False, True
+        )
+        elapsed = time.perf_counter() - start
+
+    frame_count = scene_count * SCENE_SECOND * FPS
+    print(
+        "encode: {} frames in {:.3f}s ({:.1f} fps)".format(
+            frame_count, elapsed, frame_count / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
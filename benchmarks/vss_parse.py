@@ -0,0 +1,76 @@
+"""
+VSSのパース速度を計測するベンチマーク。
+
+    $ python benchmarks/vss_parse.py [rule_count]
+"""
+
+import sys
+import time
+from os import path
+
+sys.path.append(path.join(path.dirname(path.dirname(__file__)), "src"))
+
+from vss import convert_prop_val_to_dict, convert_vss_dict  # noqa: E402
+
+PROPERTIES = [
+    "width: 50%",
+    "height: 360px",
+    "margin: 10px 20px",
+    "duration: 3s",
+    "time-margin: 0.5s 1s",
+    "background-color: #336699",
+    "font-color: rgba(255, 255, 255, 0.5)",
+    'font-family: "Noto Sans JP", sans-serif',
+]
+
+
+def create_stylesheet(rule_count: int) -> str:
+    rules = []
+    for index in range(rule_count):
+        selector = ["seq .c{}", "prl #i{}", "txt.t{}", "layer vid"][index % 4]
+        rules.append(
+            "/* rule {0} */\n{1} {{\n  {2};\n}}\n".format(
+                index,
+                selector.format(index).replace(".", " .", 1),
+                ";\n  ".join(PROPERTIES),
+            )
+        )
+    return "".join(rules)
+
+
+def measure(label: str, count: int, function, *args) -> None:
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    print(
+        "{}: {} in {:.3f}s ({:.0f}/s)".format(
+            label, count, elapsed, count / elapsed
+        )
+    )
+
+
+def parse_inline_styles(inline_styles: list[str]) -> None:
+    for inline_style in inline_styles:
+        for prop_val_str in inline_style.split(";"):
+            convert_prop_val_to_dict(prop_val_str)
+
+
+def main() -> None:
+    rule_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    measure(
+        "stylesheet rules",
+        rule_count,
+        convert_vss_dict,
+        create_stylesheet(rule_count),
+    )
+    inline_count = rule_count * 10
+    measure(
+        "inline style attributes",
+        inline_count,
+        parse_inline_styles,
+        ["; ".join(PROPERTIES)] * inline_count,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import json
-from argparse import Action, ArgumentParser, Namespace
+from argparse import Action, ArgumentParser, ArgumentTypeError, Namespace
 from collections.abc import Sequence
 
+from converter.analysis import GRAPH_BUDGET_KEYS
+from server import DEFAULT_SERVER_PORT
 from style.utils import get_font_list
 
 
@@ -32,6 +34,48 @@ class FontFamilyAction(Action):
         parser.exit()
 
 
+def parse_frames(frames_text: str) -> list[int]:
+    # "40", "0,30,60", "0-90", "0-90:15" のような指定をフレーム番号のリストにする
+    frames = []
+    try:
+        for frame_text in frames_text.split(","):
+            range_text, _, step_text = frame_text.partition(":")
+            start_text, is_range, end_text = range_text.partition("-")
+            if is_range:
+                step = int(step_text) if step_text else 1
+                if step <= 0:
+                    raise ValueError()
+                frames.extend(range(int(start_text), int(end_text) + 1, step))
+            elif step_text:
+                raise ValueError()
+            else:
+                frames.append(int(start_text))
+    except ValueError:
+        raise ArgumentTypeError("invalid frame list: '{}'".format(frames_text))
+    return frames
+
+
+def parse_graph_budget(budget_text: str) -> dict[str, float]:
+    # "nodes=2000,overlay_depth=100" のような指定を項目ごとの上限にする
+    budget = {}
+    for item_text in budget_text.split(","):
+        key, _, value_text = item_text.partition("=")
+        key = key.strip()
+        if key not in GRAPH_BUDGET_KEYS:
+            raise ArgumentTypeError(
+                "unknown graph budget key: '{}' (choose from {})".format(
+                    key, ", ".join(GRAPH_BUDGET_KEYS)
+                )
+            )
+        try:
+            budget[key] = float(value_text)
+        except ValueError:
+            raise ArgumentTypeError(
+                "invalid graph budget value: '{}'".format(item_text)
+            )
+    return budget
+
+
 def init_parser():
     parser = ArgumentParser(
         description="command line tool to struct video from xml"
@@ -40,6 +84,7 @@ def init_parser():
         "filename",
         metavar="filename",
         type=str,
+        nargs="?",
         help="file name to convert xml",
     )
     parser.add_argument(
@@ -52,9 +97,21 @@ def init_parser():
     parser.add_argument(
         "-f",
         "--frame",
-        metavar="preview_frame",
+        metavar="preview_frames",
+        type=parse_frames,
+        help="frames for preview (e.g. 40, 0,30,60, 0-90:15)",
+    )
+    parser.add_argument(
+        "--every",
+        metavar="seconds",
+        type=float,
+        help="preview a frame every given seconds",
+    )
+    parser.add_argument(
+        "--tile",
+        metavar="columns",
         type=int,
-        help="frame for preview",
+        help="put the preview frames into one contact sheet",
     )
     parser.add_argument(
         "--debug",
@@ -71,6 +128,85 @@ def init_parser():
         action="store_true",
         help="offline mode",
     )
+    parser.add_argument(
+        "--schema-refresh",
+        choices=["never", "auto", "always"],
+        default="auto",
+        help="when to re-download the cached xsd schema",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="jobs",
+        type=int,
+        default=1,
+        help="number of ffmpeg processes to encode segments in parallel",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse rendered subtrees cached by previous runs",
+    )
+    parser.add_argument(
+        "--static-stills",
+        action="store_true",
+        help="render groups of images and texts that never change "
+        "as a single still image",
+    )
+    parser.add_argument(
+        "--keep-graph",
+        action="store_true",
+        help="keep the filter graph script and reuse it "
+        "while the document is unchanged",
+    )
+    parser.add_argument(
+        "--dump-plan",
+        metavar="plan_path",
+        type=str,
+        help="save the parsed render plan as json instead of rendering",
+    )
+    parser.add_argument(
+        "--from-plan",
+        metavar="plan_path",
+        type=str,
+        help="render from a saved plan instead of a vsml file",
+    )
+    parser.add_argument(
+        "--graph-budget",
+        metavar="budget",
+        type=parse_graph_budget,
+        help="warn when the filter graph exceeds limits "
+        "(e.g. nodes=2000,overlay_depth=100,pixel_ops=5e8)",
+    )
+    parser.add_argument(
+        "--graph-budget-strict",
+        action="store_true",
+        help="fail instead of warning when the graph budget is exceeded",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="re-render whenever the vsml, stylesheets or sources change",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="run as a render daemon on localhost",
+    )
+    parser.add_argument(
+        "--port",
+        metavar="port",
+        type=int,
+        default=DEFAULT_SERVER_PORT,
+        help="port for the render daemon",
+    )
+    parser.add_argument(
+        "--workers",
+        metavar="workers",
+        type=int,
+        default=1,
+        help="number of renders the daemon runs at the same time",
+    )
     parser.add_argument(
         "--font-family-list",
         action=FontFamilyAction,
@@ -81,4 +217,9 @@ def init_parser():
 
 def get_args() -> Namespace:
     parser = init_parser()
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.filename is None and not (args.serve or args.from_plan):
+        parser.error("the following arguments are required: filename")
+    if args.from_plan is not None and args.watch:
+        parser.error("--from-plan cannot be used with --watch")
+    return args
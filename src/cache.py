@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from typing import Any, Iterable, Optional
+
+CACHE_DIR_ENV = "VSML_CACHE_DIR"
+
+
+def get_cache_dir(category: str) -> str:
+    """
+    キャッシュの種類ごとの保存先ディレクトリを返す。
+    環境変数VSML_CACHE_DIRが指定されていればそれを、なければXDGのキャッシュディレクトリを使う。
+
+    Parameters
+    ----------
+    category : str
+        キャッシュの種類
+
+    Returns
+    -------
+    cache_dir : str
+        キャッシュの保存先ディレクトリのパス
+    """
+
+    root_dir = os.environ.get(CACHE_DIR_ENV)
+    if root_dir is None:
+        root_dir = os.path.join(
+            os.environ.get(
+                "XDG_CACHE_HOME",
+                os.path.join(os.path.expanduser("~"), ".cache"),
+            ),
+            "vsml",
+        )
+    return os.path.join(root_dir, category)
+
+
+def get_cache_key(*values: Any) -> str:
+    hash_object = hashlib.sha256()
+    for value in values:
+        hash_object.update(repr(value).encode())
+        hash_object.update(b"\0")
+    return hash_object.hexdigest()
+
+
+def get_cache_path(category: str, key: str, ext: str) -> str:
+    return os.path.join(get_cache_dir(category), "{}.{}".format(key, ext))
+
+
+def _write_atomic(file_path: str, data: bytes):
+    # 並行して走る他のレンダリングが書きかけのファイルを読まないように置き換えで保存する
+    dir_path = os.path.dirname(file_path)
+    os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_json_cache(category: str, key: str) -> Optional[Any]:
+    try:
+        with open(get_cache_path(category, key, "json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json_cache(category: str, key: str, data: Any):
+    try:
+        _write_atomic(
+            get_cache_path(category, key, "json"),
+            json.dumps(data, ensure_ascii=False).encode(),
+        )
+    except OSError:
+        # キャッシュの保存に失敗しても変換自体は続ける
+        pass
+
+
+def find_file_cache(category: str, key: str, ext: str) -> Optional[str]:
+    file_path = get_cache_path(category, key, ext)
+    return file_path if os.path.exists(file_path) else None
+
+
+def save_file_cache(
+    category: str, key: str, ext: str, data: bytes
+) -> Optional[str]:
+    file_path = get_cache_path(category, key, ext)
+    try:
+        _write_atomic(file_path, data)
+    except OSError:
+        return None
+    return file_path
+
+
+def load_pickle_cache(category: str, key: str) -> Optional[Any]:
+    try:
+        with open(get_cache_path(category, key, "pickle"), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+
+def save_pickle_cache(category: str, key: str, data: Any):
+    try:
+        _write_atomic(
+            get_cache_path(category, key, "pickle"),
+            pickle.dumps(data),
+        )
+    except OSError:
+        pass
+
+
+def touch_file_cache(file_path: str):
+    # 更新時刻を最後に使った時刻として扱い、古いものから削除できるようにする
+    try:
+        os.utime(file_path)
+    except OSError:
+        pass
+
+
+def prune_file_cache(
+    category: str, max_bytes: int, keep_paths: Iterable[str] = ()
+):
+    """
+    キャッシュの合計サイズが上限を超えていれば、最後に使われたのが古いファイルから削除する。
+
+    Parameters
+    ----------
+    category : str
+        キャッシュの種類
+    max_bytes : int
+        キャッシュの合計サイズの上限
+    keep_paths : Iterable[str]
+        今回の実行で使うため削除しないファイルのパス
+    """
+
+    cache_dir = get_cache_dir(category)
+    keep_paths = {os.path.abspath(path) for path in keep_paths}
+    entries = []
+    try:
+        with os.scandir(cache_dir) as dir_entries:
+            for entry in dir_entries:
+                # 他の実行が書き出し中の一時ファイルは消さない
+                if entry.name.startswith(tempfile.gettempprefix()):
+                    continue
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, file_path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if os.path.abspath(file_path) in keep_paths:
+            continue
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        total_bytes -= size
@@ -1,4 +1,5 @@
 import re
+from typing import Optional
 
 from lxml.etree import _Element, tostring
 
@@ -6,18 +7,22 @@ from style import Style
 from utils import SourceType, VSMLManager
 
 
+def get_source_path(src_path: Optional[str]) -> str:
+    # vsmlファイルからの相対パスはルートパスを付けて解決する
+    if src_path is None:
+        raise Exception()
+    if src_path[0] != "/" and src_path[:4] != "http":
+        src_path = VSMLManager.get_root_path() + src_path
+    return src_path
+
+
 def get_source_value(
     vsml_element: _Element,
 ) -> str:
     tag_name = vsml_element.tag
     match tag_name:
         case "vid" | "aud" | "img":
-            src_path = vsml_element.get("src", None)
-            if src_path is None:
-                raise Exception()
-            if src_path[0] != "/" and src_path[:4] != "http":
-                src_path = VSMLManager.get_root_path() + src_path
-            return src_path
+            return get_source_path(vsml_element.get("src", None))
         case "txt":
             txt_child = tostring(
                 vsml_element,
@@ -0,0 +1,242 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from ffmpeg.dag import topo_sort
+from ffmpeg.nodes import FilterNode, InputNode
+
+from probe import probe_source
+
+# 映像を扱わないフィルタ。大きさの推定と画素数の計算から外す
+AUDIO_FILTERS = [
+    "adelay",
+    "aloop",
+    "amerge",
+    "amix",
+    "anullsrc",
+    "apad",
+    "asplit",
+    "atrim",
+    "volume",
+]
+# 出力フレームの全画素を毎フレーム書き換えるフィルタ
+PIXEL_FILTERS = ["drawtext", "format", "geq", "scale", "tile"]
+# 毎フレームの処理が重く、数を個別に報告するフィルタ
+HEAVY_FILTERS = ["drawtext", "geq", "loop"]
+# --graph-budgetで上限を指定できる項目
+GRAPH_BUDGET_KEYS = [
+    "nodes",
+    "inputs",
+    "split_fanout",
+    "overlay_depth",
+    "pixel_ops",
+    *HEAVY_FILTERS,
+]
+LAVFI_SIZE_PATTERN = re.compile(r"(?:^|:)s=(\d+)x(\d+)")
+
+Size = Optional[tuple[int, int]]
+
+
+@dataclass
+class GraphReport:
+    node_count: int = 0
+    input_count: int = 0
+    filter_counts: dict[str, int] = field(default_factory=dict)
+    split_count: int = 0
+    max_split_fanout: int = 0
+    max_overlay_depth: int = 0
+    pixel_ops: int = 0
+    unknown_size_count: int = 0
+
+    def get_budget_values(self) -> dict[str, int]:
+        return {
+            "nodes": self.node_count,
+            "inputs": self.input_count,
+            "split_fanout": self.max_split_fanout,
+            "overlay_depth": self.max_overlay_depth,
+            "pixel_ops": self.pixel_ops,
+        } | {
+            filter_name: self.filter_counts.get(filter_name, 0)
+            for filter_name in HEAVY_FILTERS
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "nodes": self.node_count,
+            "inputs": self.input_count,
+            "filters": dict(
+                sorted(
+                    self.filter_counts.items(),
+                    key=lambda item: (-item[1], item[0]),
+                )
+            ),
+            "splits": self.split_count,
+            "max_split_fanout": self.max_split_fanout,
+            "max_overlay_depth": self.max_overlay_depth,
+            "heavy_filters": {
+                filter_name: self.filter_counts.get(filter_name, 0)
+                for filter_name in HEAVY_FILTERS
+            },
+            "estimated_pixel_ops_per_frame": self.pixel_ops,
+            "nodes_with_unknown_size": self.unknown_size_count,
+        }
+
+
+@dataclass
+class GraphBudget:
+    limits: dict[str, float]
+    is_strict: bool = False
+
+
+def get_input_size(node: InputNode) -> Size:
+    filename = node.kwargs.get("filename", "")
+    if node.kwargs.get("format") == "lavfi":
+        match = LAVFI_SIZE_PATTERN.search(filename)
+        return None if match is None else (int(match[1]), int(match[2]))
+    try:
+        streams = probe_source(filename)["streams"]
+    except Exception:
+        return None
+    for stream in streams:
+        if stream.get("codec_type") == "video":
+            return stream["width"], stream["height"]
+    return None
+
+
+def get_scaled_size(node: FilterNode, size: Size) -> Size:
+    width, height = (list(node.args) + [None, None])[:2]
+    width = node.kwargs.get("w", width)
+    height = node.kwargs.get("h", height)
+    if not (isinstance(width, int) and isinstance(height, int)):
+        return None
+    if width < 0 and height < 0:
+        return size
+    if width < 0 or height < 0:
+        if size is None:
+            return None
+        if width < 0:
+            width = round(size[0] * height / size[1])
+        else:
+            height = round(size[1] * width / size[0])
+    return width, height
+
+
+def get_filter_size(node: FilterNode, input_sizes: list[Size]) -> Size:
+    size = input_sizes[0] if len(input_sizes) > 0 else None
+    match node.name:
+        case "scale":
+            return get_scaled_size(node, size)
+        case "tile":
+            layout = node.kwargs.get("layout", (list(node.args) + [""])[0])
+            match = re.fullmatch(r"(\d+)x(\d+)", str(layout))
+            if size is None or match is None:
+                return None
+            return size[0] * int(match[1]), size[1] * int(match[2])
+        case _:
+            # 重ね合わせや時間方向のフィルタは最初の入力の大きさを引き継ぐ
+            return size
+
+
+def get_area(size: Size) -> int:
+    return 0 if size is None else size[0] * size[1]
+
+
+def analyze_graph(process: Any) -> GraphReport:
+    """
+    ffmpegのフィルタグラフを辿り、複雑さの指標を集計する。
+    画素数は、入力の大きさから各フィルタの出力の大きさを推定して見積もる。
+
+    Parameters
+    ----------
+    process : Any
+        ffmpeg.outputで作った出力のストリーム
+
+    Returns
+    -------
+    report : GraphReport
+        フィルタの種類ごとの数、splitの分岐数、overlayの段数、1フレームあたりの推定画素数
+    """
+
+    sorted_nodes, outgoing_edge_maps = topo_sort([process.node])
+    report = GraphReport()
+    filter_counts: Counter[str] = Counter()
+    sizes: dict[Any, Size] = {}
+    overlay_depths: dict[Any, int] = {}
+
+    for node in sorted_nodes:
+        incoming_edges = sorted(
+            node.incoming_edges,
+            key=lambda edge: (
+                -1 if edge.downstream_label is None else edge.downstream_label
+            ),
+        )
+        input_sizes = [
+            sizes.get(edge.upstream_node) for edge in incoming_edges
+        ]
+        overlay_depth = max(
+            [
+                overlay_depths.get(edge.upstream_node, 0)
+                for edge in incoming_edges
+            ]
+            + [0]
+        )
+        if isinstance(node, InputNode):
+            report.input_count += 1
+            sizes[node] = get_input_size(node)
+        elif isinstance(node, FilterNode):
+            report.node_count += 1
+            filter_counts[node.name] += 1
+            if node.name in ["split", "asplit"]:
+                report.split_count += 1
+                report.max_split_fanout = max(
+                    report.max_split_fanout,
+                    len(outgoing_edge_maps.get(node, {})),
+                )
+            if node.name not in AUDIO_FILTERS:
+                size = get_filter_size(node, input_sizes)
+                sizes[node] = size
+                if size is None:
+                    report.unknown_size_count += 1
+                if node.name == "overlay":
+                    overlay_depth += 1
+                    # 重ねる側の画素だけを毎フレーム合成する
+                    report.pixel_ops += get_area(
+                        input_sizes[1] if len(input_sizes) > 1 else None
+                    )
+                elif node.name in PIXEL_FILTERS:
+                    report.pixel_ops += get_area(size)
+        overlay_depths[node] = overlay_depth
+
+    report.filter_counts = dict(filter_counts)
+    report.max_overlay_depth = max(overlay_depths.values(), default=0)
+    return report
+
+
+def check_graph_budget(report: GraphReport, budget: GraphBudget):
+    """
+    フィルタグラフの指標が予算を超えていないかを確かめる。
+    超えた項目は警告として表示し、厳格モードの場合は例外を投げる。
+
+    Parameters
+    ----------
+    report : GraphReport
+        analyze_graphの結果
+    budget : GraphBudget
+        項目ごとの上限と、超えたときに失敗させるかどうか
+    """
+
+    values = report.get_budget_values()
+    exceeded = [
+        "{}: {} > {:g}".format(key, values[key], limit)
+        for key, limit in budget.limits.items()
+        if values[key] > limit
+    ]
+    if len(exceeded) == 0:
+        return
+    message = "filter graph exceeds the budget ({})".format(
+        ", ".join(exceeded)
+    )
+    if budget.is_strict:
+        raise Exception(message)
+    print("[graph budget] warning: {}".format(message))
@@ -1,77 +1,85 @@
 # import time
+import json
 import math
-from typing import Any, Optional
+import os
+import subprocess
+import tempfile
+from typing import Any, Callable, Optional
 
 import ffmpeg
 
 from style import AudioSystem, Color, GraphicValue, TimeValue
-from utils import VSMLManager
+from utils import RenderContext, VSMLManager
 
-origin_background_processes = {}
-origin_graphic_processes: dict[str, dict[str, Any]] = {}
+from .analysis import analyze_graph, check_graph_budget
+from .script import get_graph_script_path, save_graph_args, use_filter_script
+from .text import get_text_image_path
+
+
+def get_split_output(origin_process: dict[str, Any], stream_type: str) -> Any:
+    # 同じsplitノードから出力を取り出していき、ffmpegの出力時にsplit=Nとして1つにまとめる
+    split_process = origin_process[stream_type]
+    if split_process is None:
+        return None
+    return split_process[origin_process["count"]]
 
 
 def get_background_process(
     resolution_text: str, background_color: Optional[Color] = None
 ) -> Any:
-    global origin_background_process
     key = "{}/{}".format(
         resolution_text,
         "transparent" if background_color is None else background_color.value,
     )
-    origin_background_process = origin_background_processes.get(key)
+    # 組み立て中のフィルタグラフのコンテキストで入力ノードを使い回す
+    context = VSMLManager.get_context()
+    origin_background_process = context.background_processes.get(key)
     if origin_background_process is None:
-        origin_background_process = ffmpeg.input(
-            "rgbtestsrc=s={}".format(resolution_text),
+        color_code = (
+            "0x00000000"
+            if background_color is None
+            else "0x{:02x}{:02x}{:02x}{:02x}".format(
+                background_color.r_value,
+                background_color.g_value,
+                background_color.b_value,
+                background_color.a_value,
+            )
+        )
+        # 画素ごとに式を評価するgeqではなく、単色の入力を使う
+        process = ffmpeg.input(
+            "color=c={}:s={}".format(color_code, resolution_text),
             f="lavfi",
         )
-        if background_color is None:
-            origin_background_process = ffmpeg.filter(
-                origin_background_process, "geq", a=0, r=0, g=0, b=0
-            )
-        else:
-            origin_background_process = ffmpeg.filter(
-                origin_background_process,
-                "geq",
-                a=background_color.a_value,
-                r=background_color.r_value,
-                g=background_color.g_value,
-                b=background_color.b_value,
-            )
-    background_processes = origin_background_process.split()
-    origin_background_processes[key] = background_processes[1]
-    return background_processes[0]
+        process = ffmpeg.filter(process, "format", "rgba")
+        origin_background_process = {"video": process.split(), "count": 0}
+        context.background_processes[key] = origin_background_process
+    background_process = get_split_output(origin_background_process, "video")
+    origin_background_process["count"] += 1
+    return background_process
 
 
 def get_source_process(
     src_path: str, exist_video: bool, exist_audio: bool, **option
 ) -> dict[str, Any]:
-    global origin_graphic_processes
-    origin_graphic_process = origin_graphic_processes.get(src_path)
+    # 入力のオプションが違えば別の入力として扱う
+    key = "{}/{}".format(src_path, sorted(option.items()))
+    context = VSMLManager.get_context()
+    origin_graphic_process = context.source_processes.get(key)
     if origin_graphic_process is None:
         process = ffmpeg.input(src_path, **option)
+        # 素材は一度だけデコードし、参照の数だけsplit=N、asplit=Nで分岐させる
         origin_graphic_process = {
-            "video": process.video if exist_video else None,
-            "audio": process.audio if exist_audio else None,
+            "video": process.video.split() if exist_video else None,
+            "audio": process.audio.asplit() if exist_audio else None,
+            "count": 0,
         }
-    video_graphic_processes = (
-        origin_graphic_process["video"].split()
-        if origin_graphic_process["video"] is not None
-        else (None, None)
-    )
-    audio_graphic_processes = (
-        origin_graphic_process["audio"].asplit()
-        if origin_graphic_process["audio"] is not None
-        else (None, None)
-    )
-    origin_graphic_processes[src_path] = {
-        "video": video_graphic_processes[1],
-        "audio": audio_graphic_processes[1],
-    }
-    return {
-        "video": video_graphic_processes[0],
-        "audio": audio_graphic_processes[0],
+        context.source_processes[key] = origin_graphic_process
+    source_process = {
+        "video": get_split_output(origin_graphic_process, "video"),
+        "audio": get_split_output(origin_graphic_process, "audio"),
     }
+    origin_graphic_process["count"] += 1
+    return source_process
 
 
 def get_background_color_code(
@@ -162,6 +170,15 @@ def duration_filter(
     return video_process, audio_process
 
 
+def frame_rate_filter(video_process: Any, fps: float) -> Any:
+    # 出力のフレームが入力のfpsや変換の区切り方によらず時刻だけで決まるよう、一定のfpsで取り出す。
+    # 最後のフレームが端数で落ちないよう1フレーム分伸ばすので、長さは出力側で切る
+    video_process = ffmpeg.filter(
+        video_process, "tpad", stop_mode="clone", stop_duration=1 / fps
+    )
+    return ffmpeg.filter(video_process, "fps", fps=fps, start_time=0)
+
+
 def time_space_start_filter(
     time_space_start: TimeValue,
     background_color_code: Optional[str] = None,
@@ -260,12 +277,32 @@ def get_text_process(
     font_border_color: Optional[Color],
     font_border_width: Optional[int],
 ) -> Any:
+    width_px = width.get_pixel()
+    height_px = height.get_pixel()
+    if font_path is not None and font_size is not None:
+        # 毎フレームdrawtextで描かず、一度だけ描画した画像をループさせて使う
+        image_path = get_text_image_path(
+            sentence,
+            width_px,
+            height_px,
+            padding_left.get_pixel(),
+            padding_top.get_pixel(),
+            background_color,
+            font_path,
+            font_size.get_pixel(),
+            font_color,
+            font_border_color,
+            font_border_width,
+        )
+        if image_path is not None:
+            source = get_source_process(image_path, True, False, loop=1)
+            return source["video"].filter("setsar", "1/1")
+
+    # フォントファイルがない場合はffmpegの既定のフォントで描く
     option: dict = {
         "x": padding_left.get_pixel(),
         "y": padding_top.get_pixel(),
     }
-    width_px = width.get_pixel()
-    height_px = height.get_pixel()
 
     transparent_process = get_background_process(
         "{}x{}".format(width_px, height_px),
@@ -393,8 +430,11 @@ def export_video(
     video_process: Optional[Any],
     audio_process: Optional[Any],
     out_filename: str,
+    context: RenderContext,
     debug_mode: bool,
     overwrite: bool,
+    graph_cache_key: Optional[str] = None,
+    **output_option,
 ):
     match (
         video_process,
@@ -414,20 +454,79 @@ def export_video(
                 a=1,
                 n=1,
             )
+    # 区間の書き出しのように、呼び出し側がコーデックを指定した場合はそちらを使う
+    output_option = {"vcodec": "libx264", "acodec": "aac"} | output_option
     process = ffmpeg.output(
         process,
         out_filename,
-        r=VSMLManager.get_root_fps(),
-        vcodec='libx264',
-        acodec='aac'
+        r=context.root_fps,
+        **output_option,
     )
 
     if debug_mode:
         # ffmpeg.view(process)
         # time.sleep(0.1)
         print("\n[[[command args]]]\n{}".format(ffmpeg.compile(process)))
+    if debug_mode or context.graph_budget is not None:
+        report = analyze_graph(process)
+        if debug_mode:
+            print(
+                "\n[[[graph analysis]]]\n{}".format(
+                    json.dumps(report.to_dict(), indent=2)
+                )
+            )
+        if context.graph_budget is not None:
+            check_graph_budget(report, context.graph_budget)
 
-    ffmpeg.run(
-        process,
-        overwrite_output=overwrite,
-    )
+    run_process(process, overwrite, context.progress_callback, graph_cache_key)
+
+
+def run_process(
+    process: Any,
+    overwrite: bool,
+    progress_callback: Optional[Callable[[dict[str, str]], None]] = None,
+    graph_cache_key: Optional[str] = None,
+):
+    # フィルタグラフは引数に並べず、ファイルに書き出して渡す
+    args = ffmpeg.compile(process)
+    overwrite_args = ["-y"] if overwrite else []
+    if graph_cache_key is not None:
+        args = use_filter_script(args, get_graph_script_path(graph_cache_key))
+        run_args(args + overwrite_args, progress_callback)
+        # 成功したときだけ、次回にグラフを組み立てずに実行できるよう引数を残す
+        save_graph_args(graph_cache_key, args)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args = use_filter_script(
+            args, os.path.join(tmp_dir, "filter_complex.txt")
+        )
+        run_args(args + overwrite_args, progress_callback)
+
+
+def run_args(
+    args: list[str],
+    progress_callback: Optional[Callable[[dict[str, str]], None]] = None,
+):
+    if progress_callback is None:
+        # ffmpeg.runと同じく、ffmpegの出力はそのまま表示する
+        if subprocess.run(args).returncode != 0:
+            raise ffmpeg.Error("ffmpeg", None, None)
+        return
+
+    # -progressで標準出力に書かれるkey=valueのまとまりごとに進捗を通知する
+    args = args.copy()
+    args[1:1] = ["-progress", "pipe:1", "-nostats"]
+    with tempfile.TemporaryFile() as err_file:
+        with subprocess.Popen(
+            args, stdout=subprocess.PIPE, stderr=err_file, text=True
+        ) as ffmpeg_process:
+            progress = {}
+            for line in ffmpeg_process.stdout:
+                key, _, value = line.strip().partition("=")
+                progress[key] = value
+                if key == "progress":
+                    progress_callback(progress)
+                    progress = {}
+        if ffmpeg_process.returncode != 0:
+            err_file.seek(0)
+            raise ffmpeg.Error("ffmpeg", None, err_file.read())
@@ -0,0 +1,178 @@
+import os
+import tempfile
+from typing import Any, Optional
+
+import ffmpeg
+
+from cache import get_cache_dir, get_cache_key, get_cache_path
+from content import SourceContent, VSMLContent, WrapContent
+from probe import get_source_fingerprint, probe_source
+from utils import RenderContext, SourceType
+
+from .schemas import Process
+
+SUBTREE_CACHE_CATEGORY = "subtree"
+# 中間ファイルの書き出し方を変えたら古いキャッシュを使わないようにする
+SUBTREE_CACHE_VERSION = 2
+SUBTREE_CACHE_EXT = "mkv"
+# 透過と音声を劣化させずに保存できる形式で書き出す
+SUBTREE_VIDEO_OPTION = {"vcodec": "ffv1", "pix_fmt": "bgra"}
+SUBTREE_AUDIO_OPTION = {"acodec": "pcm_s16le"}
+# 中間ファイルは大きいので、合計がこれを超えたら最後に使われたのが古いものから消す
+SUBTREE_CACHE_MAX_BYTES = 8 * 1024**3
+
+
+def get_subtree_signature(vsml_content: VSMLContent) -> Optional[tuple]:
+    if isinstance(vsml_content, SourceContent):
+        if vsml_content.type == SourceType.TEXT:
+            font_path = vsml_content.style.using_font_path
+            font_fingerprint = None
+            if font_path is not None:
+                # 同じフォント名でも、入っているフォントファイルが変われば描画が変わる
+                font_fingerprint = get_source_fingerprint(font_path)
+                if font_fingerprint is None:
+                    return None
+            source_signature = (vsml_content.src_path, font_fingerprint)
+        else:
+            source_signature = get_source_fingerprint(vsml_content.src_path)
+            if source_signature is None:
+                # 変更を検知できない素材はキャッシュしない
+                return None
+        return (
+            vsml_content.tag_name,
+            repr(vsml_content.style),
+            source_signature,
+        )
+    elif isinstance(vsml_content, WrapContent):
+        item_signatures = []
+        for item in vsml_content.items:
+            item_signature = get_subtree_signature(item)
+            if item_signature is None:
+                return None
+            item_signatures.append(item_signature)
+        return (
+            vsml_content.tag_name,
+            repr(vsml_content.style),
+            tuple(item_signatures),
+        )
+    else:
+        raise Exception()
+
+
+def get_subtree_cache_path(
+    vsml_content: VSMLContent,
+    context: RenderContext,
+) -> Optional[str]:
+    """
+    サブツリーの中間ファイルの保存先を返す。
+    タグ名、解決済みのスタイル、素材の指紋を子孫まで含めてハッシュし、キーにする。
+
+    Parameters
+    ----------
+    vsml_content : VSMLContent
+        キャッシュするサブツリーの根の要素
+    context : RenderContext
+        変換のコンテキスト
+
+    Returns
+    -------
+    cache_path : Optional[str]
+        中間ファイルのパス。変更を検知できない素材を含む場合はNone
+    """
+
+    signature = get_subtree_signature(vsml_content)
+    if signature is None:
+        return None
+    cache_key = get_cache_key(
+        SUBTREE_CACHE_VERSION,
+        context.root_resolution.get_str(),
+        context.root_fps,
+        signature,
+    )
+    return get_cache_path(SUBTREE_CACHE_CATEGORY, cache_key, SUBTREE_CACHE_EXT)
+
+
+def find_subtree_cache_targets(
+    vsml_content: VSMLContent,
+) -> list[VSMLContent]:
+    # ルートから子要素が1つのラップ要素を辿り、最初に枝分かれした子要素ごとにキャッシュする
+    while (
+        isinstance(vsml_content, WrapContent) and len(vsml_content.items) == 1
+    ):
+        vsml_content = vsml_content.items[0]
+    if not isinstance(vsml_content, WrapContent):
+        return []
+    targets = []
+    for item in vsml_content.items:
+        # 長さが決まらない要素は書き出せない
+        if not item.style.get_duration_with_padding().has_specific_value():
+            continue
+        if not (item.exist_video or item.exist_audio):
+            continue
+        targets.append(item)
+    return targets
+
+
+def get_cached_subtree_process(
+    vsml_content: VSMLContent,
+    context: RenderContext,
+) -> Optional[Process]:
+    cache_path = context.cached_subtree_paths.get(id(vsml_content))
+    if cache_path is None:
+        return None
+    codec_types = [
+        stream["codec_type"] for stream in probe_source(cache_path)["streams"]
+    ]
+    source = ffmpeg.input(cache_path)
+    return Process(
+        source.video if "video" in codec_types else None,
+        source.audio if "audio" in codec_types else None,
+        vsml_content.style,
+    )
+
+
+def get_subtree_render_process(
+    process: Process,
+    cache_path: str,
+    context: RenderContext,
+) -> tuple[Any, str]:
+    """
+    サブツリーの映像と音声を中間ファイルに書き出すffmpegの処理を作る。
+    書きかけのファイルを他の実行が読まないよう、一時ファイルに書き出して後で置き換える。
+
+    Parameters
+    ----------
+    process : Process
+        サブツリーの処理
+    cache_path : str
+        中間ファイルのパス
+    context : RenderContext
+        変換のコンテキスト
+
+    Returns
+    -------
+    output_process : Any
+        中間ファイルを書き出すffmpegの処理
+    tmp_path : str
+        書き出し先の一時ファイルのパス
+    """
+
+    os.makedirs(get_cache_dir(SUBTREE_CACHE_CATEGORY), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(cache_path),
+        suffix=".{}".format(SUBTREE_CACHE_EXT),
+    )
+    os.close(fd)
+
+    streams = []
+    option = {
+        "t": process.style.get_duration_with_padding().get_second(),
+    }
+    if process.video is not None:
+        streams.append(process.video)
+        option |= SUBTREE_VIDEO_OPTION | {"r": context.root_fps}
+    if process.audio is not None:
+        streams.append(process.audio)
+        option |= SUBTREE_AUDIO_OPTION
+    output_process = ffmpeg.output(*streams, tmp_path, **option)
+    return output_process, tmp_path
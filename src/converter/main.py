@@ -1,46 +1,177 @@
-from typing import Optional
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
 
-from content import SourceContent, VSMLContent, WrapContent
-from utils import VSMLManager
+import ffmpeg
+
+from cache import prune_file_cache, touch_file_cache
+from content import VSMLContent
+from utils import RenderContext
 from vsml import VSML
 
-from .content import create_source_process
-from .ffmpeg import (
-    export_video,
-    get_background_process,
-    duration_filter,
-    set_background_filter,
-    time_space_end_filter,
-    time_space_start_filter,
+from .ffmpeg import export_video, run_args
+from .incremental import (
+    SUBTREE_CACHE_CATEGORY,
+    SUBTREE_CACHE_MAX_BYTES,
+    find_subtree_cache_targets,
+    get_subtree_cache_path,
+    get_subtree_render_process,
+)
+from .process import create_process, create_root_process
+from .script import get_graph_cache_key, load_graph_args
+from .segment import convert_video_by_segments, find_segment_path
+from .static import (
+    find_static_subtrees,
+    get_static_still_path,
+    get_static_still_render_process,
 )
-from .schemas import Process
-from .wrap import create_wrap_process
 
 
-def create_process(
+def run_subtree_render(output_process: Any, tmp_path: str, cache_path: str):
+    try:
+        ffmpeg.run(output_process, overwrite_output=True)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def render_subtree_cache(
     vsml_content: VSMLContent,
-    debug_mode: bool = False,
-) -> Process:
-    if isinstance(vsml_content, SourceContent):
-        process = create_source_process(
-            vsml_content,
-            debug_mode,
+    context: RenderContext,
+    debug_mode: bool,
+    jobs: int = 1,
+):
+    """
+    ルート直下の子要素ごとに中間ファイルを用意し、以降の処理でそれを入力として使うよう登録する。
+    前回の実行から変わっていない子要素は書き出さずにキャッシュを再利用する。
+
+    Parameters
+    ----------
+    vsml_content : VSMLContent
+        ルートの要素
+    context : RenderContext
+        変換のコンテキスト。キャッシュ済みのサブツリーが登録される
+    debug_mode : bool
+        デバッグモード
+    jobs : int
+        同時に実行するffmpegの数
+    """
+
+    context.cached_subtree_paths.clear()
+    cached_targets = []
+    render_tasks = []
+    with context.activate():
+        for target in find_subtree_cache_targets(vsml_content):
+            cache_path = get_subtree_cache_path(target, context)
+            if cache_path is None:
+                continue
+            if not os.path.exists(cache_path):
+                # 変わった子要素だけを、それぞれ別のフィルタグラフで書き出す
+                subtree_context = context.fork()
+                process = create_process(target, subtree_context, debug_mode)
+                if process.video is None and process.audio is None:
+                    continue
+                output_process, tmp_path = get_subtree_render_process(
+                    process, cache_path, subtree_context
+                )
+                if debug_mode:
+                    print(
+                        "\n[[[subtree command args]]]\n{}".format(
+                            ffmpeg.compile(output_process)
+                        )
+                    )
+                render_tasks.append((output_process, tmp_path, cache_path))
+            else:
+                touch_file_cache(cache_path)
+            cached_targets.append((target, cache_path))
+
+    if debug_mode:
+        print(
+            "\n[[[subtree cache]]]\nreused: {}, rendered: {}".format(
+                len(cached_targets) - len(render_tasks), len(render_tasks)
+            )
         )
-    elif isinstance(vsml_content, WrapContent):
-        child_processes = []
-        for item in vsml_content.items:
-            child_process = create_process(item, debug_mode)
-            if child_process is not None:
-                child_processes.append(child_process)
-        process = create_wrap_process(
-            child_processes,
-            vsml_content,
-            debug_mode,
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [
+            executor.submit(run_subtree_render, *render_task)
+            for render_task in render_tasks
+        ]
+        for future in futures:
+            future.result()
+
+    for target, cache_path in cached_targets:
+        context.cached_subtree_paths[id(target)] = cache_path
+    prune_file_cache(
+        SUBTREE_CACHE_CATEGORY,
+        SUBTREE_CACHE_MAX_BYTES,
+        [cache_path for _, cache_path in cached_targets],
+    )
+
+
+def render_static_stills(
+    vsml_content: VSMLContent,
+    context: RenderContext,
+    debug_mode: bool,
+    jobs: int = 1,
+):
+    """
+    画像とテキストだけからなり、長さの間ずっと同じ絵を出すサブツリーを1枚の静止画に書き出し、
+    以降の処理で重ね合わせの代わりにその画像をループさせて使うよう登録する。
+
+    Parameters
+    ----------
+    vsml_content : VSMLContent
+        ルートの要素
+    context : RenderContext
+        変換のコンテキスト。静止画にまとめたサブツリーが登録される
+    debug_mode : bool
+        デバッグモード
+    jobs : int
+        同時に実行するffmpegの数
+    """
+
+    context.static_still_paths.clear()
+    still_targets = []
+    render_tasks = []
+    with context.activate():
+        for target in find_static_subtrees(vsml_content):
+            still_path = get_static_still_path(target, context)
+            if still_path is None:
+                continue
+            if not os.path.exists(still_path):
+                # 1フレームだけのffmpegの実行で、重ね合わせた結果を書き出す
+                still_context = context.fork()
+                process = create_process(target, still_context, debug_mode)
+                output_process, tmp_path = get_static_still_render_process(
+                    process, still_path
+                )
+                render_tasks.append((output_process, tmp_path, still_path))
+            still_targets.append((target, still_path))
+
+    if debug_mode:
+        print(
+            "\n[[[static stills]]]\nreused: {}, rendered: {}".format(
+                len(still_targets) - len(render_tasks), len(render_tasks)
+            )
         )
-    else:
-        raise Exception()
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [
+            executor.submit(run_subtree_render, *render_task)
+            for render_task in render_tasks
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                # 書き出せなかった静止画は使わず、通常の重ね合わせで描画する
+                if debug_mode:
+                    traceback.print_exc()
 
-    return process
+    for target, still_path in still_targets:
+        if os.path.exists(still_path):
+            context.static_still_paths[id(target)] = still_path
 
 
 def convert_video(
@@ -48,33 +179,58 @@ def convert_video(
     out_filename: Optional[str],
     debug_mode: bool,
     overwrite: bool,
+    jobs: int = 1,
+    incremental: bool = False,
+    keep_graph: bool = False,
+    static_stills: bool = False,
 ):
     out_filename = "video.mp4" if out_filename is None else out_filename
+    context = vsml_data.context
 
-    process = create_process(vsml_data.content, debug_mode)
-    style = vsml_data.content.style
-    if process.video is None:
-        black_video_process = get_background_process(VSMLManager.get_root_resolution().get_str())
-        process.video, _ = duration_filter(style.duration, black_video_process, None)
-    else:
-        process.video = set_background_filter(
-            background_color=style.background_color,
-            resolution_text=VSMLManager.get_root_resolution().get_str(),
-            video_process=process.video,
-            fit_video_process=True,
-        )
-    process.video, process.audio = time_space_start_filter(
-        style.time_margin_start,
-        video_process=process.video,
-        audio_process=process.audio,
-    )
-    if style.duration.has_specific_value():
-        process.video, process.audio = time_space_end_filter(
-            style.time_margin_end,
-            video_process=process.video,
-            audio_process=process.audio,
+    segment_path = None
+    if jobs > 1:
+        with context.activate():
+            segment_path = find_segment_path(vsml_data.content)
+
+    graph_cache_key = None
+    if keep_graph and not incremental and segment_path is None:
+        with context.activate():
+            graph_cache_key = get_graph_cache_key(
+                vsml_data.content, context, {}
+            )
+    if graph_cache_key is not None:
+        args = load_graph_args(graph_cache_key, out_filename, overwrite)
+        if args is not None:
+            # 前回と同じ内容なら、フィルタグラフを組み立てずに同じ引数で実行する
+            if debug_mode:
+                print("\n[[[graph cache]]]\nreused: {}".format(args))
+            run_args(args, context.progress_callback)
+            return
+
+    if static_stills:
+        render_static_stills(vsml_data.content, context, debug_mode, jobs)
+    if incremental:
+        render_subtree_cache(vsml_data.content, context, debug_mode, jobs)
+
+    if segment_path is not None:
+        # ルート直下のシーケンスを子要素ごとに分割して並列にエンコードする
+        convert_video_by_segments(
+            segment_path,
+            out_filename,
+            context,
+            debug_mode,
+            overwrite,
+            jobs,
         )
+        return
 
+    process = create_root_process(vsml_data.content, context, debug_mode)
     export_video(
-        process.video, process.audio, out_filename, debug_mode, overwrite
+        process.video,
+        process.audio,
+        out_filename,
+        context,
+        debug_mode,
+        overwrite,
+        graph_cache_key,
     )
@@ -1 +1,6 @@
-from .main import convert_image_from_frame
+from .main import (
+    convert_image_from_frame,
+    convert_image_from_frames,
+    get_frames_every,
+    get_preview_frames,
+)
@@ -1,3 +1,4 @@
+import copy
 from typing import Optional
 
 from style import Order
@@ -10,9 +11,11 @@ def pick_data(
     if not vsml_content.exist_video:
         return None
     if isinstance(vsml_content, WrapContent):
+        # 元の木を残して何度でもプレビューできるよう、複製した要素に子要素を選び直す
+        items = vsml_content.items
+        vsml_content = copy.copy(vsml_content)
+        vsml_content.items = []
         if vsml_content.style.order == Order.SEQUENCE:
-            items = vsml_content.items
-            vsml_content.items = []
             whole_second = 0
             left_margin_end = 0
 
@@ -24,6 +27,7 @@ def pick_data(
                     return vsml_content
                 whole_second += item.style.time_padding_start.get_second()
                 if second < whole_second:
+                    item = copy.copy(item)
                     item._second = -1
                     vsml_content.items = [item]
                     return vsml_content
@@ -38,21 +42,20 @@ def pick_data(
                 whole_second = whole_second_with_duration
                 whole_second += item.style.time_padding_end.get_second()
                 if second < whole_second:
+                    item = copy.copy(item)
                     item._second = -1
                     vsml_content.items = [item]
                     return vsml_content
                 left_margin_end = item.style.time_margin_end.get_second()
 
         elif vsml_content.style.order == Order.PARALLEL:
-            items = vsml_content.items
-            vsml_content.items = []
-
             for item in items:
                 whole_second = item.style.time_margin_start.get_second()
                 if second < whole_second:
                     continue
                 whole_second += item.style.time_padding_start.get_second()
                 if second < whole_second:
+                    item = copy.copy(item)
                     item._second = -1
                     vsml_content.items.append(item)
                     continue
@@ -70,6 +73,7 @@ def pick_data(
                 whole_second = whole_second_with_duration
                 whole_second += item.style.time_padding_end.get_second()
                 if second < whole_second:
+                    item = copy.copy(item)
                     item._second = -1
                     vsml_content.items.append(item)
                     continue
@@ -78,6 +82,7 @@ def pick_data(
         else:
             raise Exception()
     elif isinstance(vsml_content, SourceContent):
+        vsml_content = copy.copy(vsml_content)
         vsml_content._second = second
         return vsml_content
     else:
@@ -1,38 +1,165 @@
-from typing import Optional
+import copy
+import math
+import os
+from typing import Any, Optional
 
 import ffmpeg
 
 from converter.ffmpeg import set_background_filter
-from utils import VSMLManager
+from utils import RenderContext
 from vsml import VSML, WrapContent
 
 from .content import pick_data
 from .process import create_preview_process
 
 
-def convert_image_from_frame(
-    vsml_data: VSML, frame: int, output_path: Optional[str]
+def create_frame_process(
+    vsml_data: VSML, frame: int, context: RenderContext
+) -> Any:
+    second = frame / context.root_fps
+    with context.activate():
+        if second > vsml_data.content.style.duration.get_second():
+            raise Exception()
+        vsml_content_for_pick = None
+        vsml_content = vsml_data.content
+        if second >= vsml_content.style.time_margin_start.get_second():
+            if second < vsml_content.style.time_padding_start.get_second():
+                vsml_content_for_pick = copy.copy(vsml_content)
+                if isinstance(vsml_content, WrapContent):
+                    vsml_content_for_pick.items = []
+            else:
+                vsml_content_for_pick = pick_data(vsml_content, second)
+
+        process = create_preview_process(vsml_content_for_pick, context)
+        return set_background_filter(
+            background_color=vsml_content.style.background_color,
+            resolution_text=context.root_resolution.get_str(),
+            video_process=process.video,
+            fit_video_process=True,
+        )
+
+
+def get_frame_output_path(output_path: str, frame: int, digit: int) -> str:
+    root, ext = os.path.splitext(output_path)
+    return "{}_{:0{}d}{}".format(root, frame, digit, ext)
+
+
+def get_frames_every(vsml_data: VSML, every_second: float) -> list[int]:
+    """
+    指定した秒数ごとのフレーム番号を、動画の長さの範囲で返す。
+
+    Parameters
+    ----------
+    vsml_data : VSML
+        VSMLオブジェクト
+    every_second : float
+        フレームを取り出す間隔(秒)
+
+    Returns
+    -------
+    frames : list[int]
+        フレーム番号のリスト
+    """
+
+    context = vsml_data.context
+    with context.activate():
+        duration = vsml_data.content.style.duration
+        whole_second = duration.get_second()
+    if not duration.has_specific_value() or whole_second <= 0:
+        # 長さが無限だと、取り出すフレームの範囲が決まらない
+        raise Exception(
+            "--every needs a finite duration, but the root duration is {}; "
+            "set a duration or use --frame".format(duration)
+        )
+    step = max(round(every_second * context.root_fps), 1)
+    return list(range(0, math.floor(whole_second * context.root_fps), step))
+
+
+def get_preview_frames(
+    vsml_data: VSML,
+    frames: Optional[list[int]],
+    every_second: Optional[float],
+) -> Optional[list[int]]:
+    # フレームの指定と間隔の指定を合わせ、どちらもなければ動画を出力する
+    if frames is None and every_second is None:
+        return None
+    preview_frames = set() if frames is None else set(frames)
+    if every_second is not None:
+        preview_frames.update(get_frames_every(vsml_data, every_second))
+    return sorted(preview_frames)
+
+
+def convert_image_from_frames(
+    vsml_data: VSML,
+    frames: list[int],
+    output_path: Optional[str],
+    tile_columns: Optional[int] = None,
 ) -> None:
-    output_path = "preview.png" if output_path is None else output_path
-    second = frame / VSMLManager.get_root_fps()
-    if second > vsml_data.content.style.duration.get_second():
+    """
+    複数のフレームのプレビュー画像を、1回のffmpegの実行でまとめて出力する。
+    素材の入力は全フレームで共有し、一度だけデコードする。
+
+    Parameters
+    ----------
+    vsml_data : VSML
+        VSMLオブジェクト
+    frames : list[int]
+        出力するフレーム番号のリスト
+    output_path : Optional[str]
+        出力する画像のパス。複数のフレームを個別に出力する場合は、末尾にフレーム番号を付ける
+    tile_columns : Optional[int]
+        指定した場合は、この列数で並べた1枚のコンタクトシートとして出力する
+    """
+
+    if len(frames) == 0:
         raise Exception()
-    vsml_content_for_pick = None
-    vsml_content = vsml_data.content
-    if second >= vsml_content.style.time_margin_start.get_second():
-        if second < vsml_content.style.time_padding_start.get_second():
-            if isinstance(vsml_content, WrapContent):
-                vsml_content.items = []
-            vsml_content_for_pick = vsml_content
-        else:
-            vsml_content_for_pick = pick_data(vsml_content, second)
-
-    process = create_preview_process(vsml_content_for_pick)
-    process.video = set_background_filter(
-        background_color=vsml_content.style.background_color,
-        resolution_text=VSMLManager.get_root_resolution().get_str(),
-        video_process=process.video,
-        fit_video_process=True,
-    )
-    process = ffmpeg.output(process.video, output_path, vframes=1)
+    output_path = "preview.png" if output_path is None else output_path
+    # 全フレームで入力ノードを共有する、このプレビュー専用のフィルタグラフ
+    context = vsml_data.context.fork()
+    frame_processes = [
+        create_frame_process(vsml_data, frame, context) for frame in frames
+    ]
+
+    if tile_columns is not None:
+        resolution = context.root_resolution
+        width = resolution.width // tile_columns
+        height = round(resolution.height * width / resolution.width / 2) * 2
+        tile_processes = []
+        for video_process in frame_processes:
+            video_process = ffmpeg.trim(video_process, end_frame=1)
+            video_process = ffmpeg.filter(
+                video_process, "setpts", "PTS-STARTPTS"
+            )
+            tile_processes.append(
+                ffmpeg.filter(video_process, "scale", width, height)
+            )
+        video_process = ffmpeg.concat(*tile_processes)
+        video_process = ffmpeg.filter(
+            video_process,
+            "tile",
+            "{}x{}".format(
+                tile_columns, math.ceil(len(frames) / tile_columns)
+            ),
+        )
+        process = ffmpeg.output(video_process, output_path, vframes=1)
+    elif len(frames) == 1:
+        process = ffmpeg.output(frame_processes[0], output_path, vframes=1)
+    else:
+        digit = len(str(max(frames)))
+        process = ffmpeg.merge_outputs(
+            *[
+                ffmpeg.output(
+                    video_process,
+                    get_frame_output_path(output_path, frame, digit),
+                    vframes=1,
+                )
+                for frame, video_process in zip(frames, frame_processes)
+            ]
+        )
     process.run(overwrite_output=True)
+
+
+def convert_image_from_frame(
+    vsml_data: VSML, frame: int, output_path: Optional[str]
+) -> None:
+    convert_image_from_frames(vsml_data, [frame], output_path)
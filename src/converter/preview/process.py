@@ -12,7 +12,7 @@ from converter.ffmpeg import (
 )
 from converter.schemas import Process
 from style import GraphicValue, LayerMode, Order
-from utils import SourceType
+from utils import RenderContext, SourceType
 from vsml import SourceContent, VSMLContent, WrapContent
 
 
@@ -33,11 +33,21 @@ def create_preview_source_process(vsml_content: SourceContent) -> Process:
             style.font_border_width,
         )
     else:
+        input_option = {}
+        if vsml_content._second != -1 and vsml_content.tag_name == "vid":
+            # 入力側でシークし、指定した位置の直前のキーフレームからだけデコードする
+            input_option["ss"] = vsml_content._second
         video_process = get_source_process(
             vsml_content.src_path,
             exist_video=True,
             exist_audio=False,
+            **input_option,
         )["video"]
+        if "ss" in input_option:
+            # シーク後の最初のフレームが背景の最初のフレームに重なるよう、時刻を0から始める
+            video_process = ffmpeg.filter(
+                video_process, "setpts", "PTS-STARTPTS"
+            )
     if vsml_content.type != SourceType.TEXT:
         video_process = width_height_filter(
             style.width, style.height, video_process
@@ -55,8 +65,6 @@ def create_preview_source_process(vsml_content: SourceContent) -> Process:
                 position_y=style.padding_top,
                 fit_video_process=True,
             )
-    if vsml_content._second != -1 and vsml_content.tag_name == "vid":
-        video_process = ffmpeg.trim(video_process, start=vsml_content._second)
     return Process(video_process, None, vsml_content.style)
 
 
@@ -148,17 +156,23 @@ def create_preview_wrap_process(
     return Process(video_process, None, style)
 
 
-def create_preview_process(vsml_content: Optional[VSMLContent]) -> Process:
-    if isinstance(vsml_content, SourceContent):
-        process = create_preview_source_process(vsml_content)
-    elif isinstance(vsml_content, WrapContent):
-        child_processes = []
-        for item in vsml_content.items:
-            child_process = create_preview_process(item)
-            if child_process is not None:
-                child_processes.append(child_process)
-        process = create_preview_wrap_process(child_processes, vsml_content)
-    else:
-        raise Exception()
+def create_preview_process(
+    vsml_content: Optional[VSMLContent],
+    context: RenderContext,
+) -> Process:
+    with context.activate():
+        if isinstance(vsml_content, SourceContent):
+            process = create_preview_source_process(vsml_content)
+        elif isinstance(vsml_content, WrapContent):
+            child_processes = []
+            for item in vsml_content.items:
+                child_process = create_preview_process(item, context)
+                if child_process is not None:
+                    child_processes.append(child_process)
+            process = create_preview_wrap_process(
+                child_processes, vsml_content
+            )
+        else:
+            raise Exception()
 
     return process
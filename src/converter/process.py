@@ -0,0 +1,93 @@
+from content import SourceContent, VSMLContent, WrapContent
+from utils import RenderContext
+
+from .content import create_source_process
+from .ffmpeg import (
+    duration_filter,
+    get_background_process,
+    set_background_filter,
+    time_space_end_filter,
+    time_space_start_filter,
+)
+from .incremental import get_cached_subtree_process
+from .schemas import Process
+from .static import get_static_still_process
+from .wrap import create_wrap_process
+
+
+def create_process(
+    vsml_content: VSMLContent,
+    context: RenderContext,
+    debug_mode: bool = False,
+) -> Process:
+    cached_process = get_cached_subtree_process(vsml_content, context)
+    if cached_process is not None:
+        return cached_process
+    still_process = get_static_still_process(vsml_content, context)
+    if still_process is not None:
+        return still_process
+    with context.activate():
+        if isinstance(vsml_content, SourceContent):
+            process = create_source_process(
+                vsml_content,
+                debug_mode,
+            )
+        elif isinstance(vsml_content, WrapContent):
+            child_processes = []
+            for item in vsml_content.items:
+                child_process = create_process(item, context, debug_mode)
+                if child_process is not None:
+                    child_processes.append(child_process)
+            process = create_wrap_process(
+                child_processes,
+                vsml_content,
+                debug_mode,
+            )
+        else:
+            raise Exception()
+
+    return process
+
+
+def create_root_process(
+    vsml_content: VSMLContent,
+    context: RenderContext,
+    debug_mode: bool = False,
+) -> Process:
+    process = create_process(vsml_content, context, debug_mode)
+    return adjust_root_process(process, vsml_content, context)
+
+
+def adjust_root_process(
+    process: Process,
+    vsml_content: VSMLContent,
+    context: RenderContext,
+) -> Process:
+    style = vsml_content.style
+    with context.activate():
+        if process.video is None:
+            black_video_process = get_background_process(
+                context.root_resolution.get_str()
+            )
+            process.video, _ = duration_filter(
+                style.duration, black_video_process, None
+            )
+        else:
+            process.video = set_background_filter(
+                background_color=style.background_color,
+                resolution_text=context.root_resolution.get_str(),
+                video_process=process.video,
+                fit_video_process=True,
+            )
+        process.video, process.audio = time_space_start_filter(
+            style.time_margin_start,
+            video_process=process.video,
+            audio_process=process.audio,
+        )
+        if style.duration.has_specific_value():
+            process.video, process.audio = time_space_end_filter(
+                style.time_margin_end,
+                video_process=process.video,
+                audio_process=process.audio,
+            )
+    return process
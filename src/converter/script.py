@@ -0,0 +1,122 @@
+import os
+from typing import Any, Optional
+
+from cache import (
+    get_cache_dir,
+    get_cache_key,
+    get_cache_path,
+    load_json_cache,
+    save_json_cache,
+)
+from content import VSMLContent
+from utils import RenderContext
+
+from .incremental import get_subtree_signature
+
+FILTER_COMPLEX_OPTION = "-filter_complex"
+FILTER_SCRIPT_OPTION = "-filter_complex_script"
+GRAPH_CACHE_CATEGORY = "graph"
+# フィルタグラフの組み立て方を変えたら古いキャッシュを使わないようにする
+GRAPH_CACHE_VERSION = 1
+GRAPH_SCRIPT_EXT = "txt"
+
+
+def use_filter_script(args: list[str], script_path: str) -> list[str]:
+    """
+    ffmpegの引数の-filter_complexをファイルに書き出し、-filter_complex_scriptで渡すようにする。
+    大きなフィルタグラフでも引数の長さの上限に当たらないようにする。
+
+    Parameters
+    ----------
+    args : list[str]
+        ffmpeg.compileで作ったffmpegの引数
+    script_path : str
+        フィルタグラフを書き出すファイルのパス
+
+    Returns
+    -------
+    args : list[str]
+        フィルタグラフをファイルから読むようにした引数
+    """
+
+    if FILTER_COMPLEX_OPTION not in args:
+        return args
+    index = args.index(FILTER_COMPLEX_OPTION)
+    with open(script_path, "w") as f:
+        f.write(args[index + 1])
+    return (
+        args[:index] + [FILTER_SCRIPT_OPTION, script_path] + args[index + 2 :]
+    )
+
+
+def get_graph_cache_key(
+    vsml_content: VSMLContent,
+    context: RenderContext,
+    output_option: dict[str, Any],
+) -> Optional[str]:
+    # 要素の木と素材が同じなら、同じフィルタグラフになる
+    signature = get_subtree_signature(vsml_content)
+    if signature is None:
+        return None
+    return get_cache_key(
+        GRAPH_CACHE_VERSION,
+        context.root_resolution.get_str(),
+        context.root_fps,
+        sorted(output_option.items()),
+        signature,
+    )
+
+
+def get_graph_script_path(graph_cache_key: str) -> str:
+    os.makedirs(get_cache_dir(GRAPH_CACHE_CATEGORY), exist_ok=True)
+    return get_cache_path(
+        GRAPH_CACHE_CATEGORY, graph_cache_key, GRAPH_SCRIPT_EXT
+    )
+
+
+def save_graph_args(graph_cache_key: str, args: list[str]):
+    # 出力先は実行ごとに変わるため、最後の引数(出力ファイル)は保存しない
+    save_json_cache(GRAPH_CACHE_CATEGORY, graph_cache_key, args[:-1])
+
+
+def is_input_available(args: list[str], index: int) -> bool:
+    if args[index - 2 : index] == ["-f", "lavfi"]:
+        return True
+    input_path = args[index + 1]
+    return input_path[:4] == "http" or os.path.exists(input_path)
+
+
+def load_graph_args(
+    graph_cache_key: str, out_filename: str, overwrite: bool
+) -> Optional[list[str]]:
+    """
+    保存したffmpegの引数を読み込み、フィルタグラフを組み立て直さずに実行できるようにする。
+    フィルタグラフのファイルや、入力にしている中間ファイルがなくなっていればNoneを返す。
+
+    Parameters
+    ----------
+    graph_cache_key : str
+        get_graph_cache_keyで作ったキー
+    out_filename : str
+        出力するファイルのパス
+    overwrite : bool
+        出力ファイルを上書きするかどうか
+
+    Returns
+    -------
+    args : Optional[list[str]]
+        ffmpegの引数
+    """
+
+    args = load_json_cache(GRAPH_CACHE_CATEGORY, graph_cache_key)
+    if args is None:
+        return None
+    for index, arg in enumerate(args):
+        if arg == FILTER_SCRIPT_OPTION and not os.path.exists(args[index + 1]):
+            return None
+        if arg == "-i" and not is_input_available(args, index):
+            return None
+    args = args + [out_filename]
+    if overwrite:
+        args.append("-y")
+    return args
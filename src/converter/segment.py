@@ -0,0 +1,318 @@
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import ffmpeg
+
+from content import VSMLContent, WrapContent
+from style import Order, TimeValue
+from utils import RenderContext
+
+from .ffmpeg import (
+    export_video,
+    frame_rate_filter,
+    get_background_color_code,
+    run_process,
+    time_space_start_filter,
+)
+from .process import adjust_root_process, create_process
+from .schemas import Process
+from .wrap import create_wrap_process
+
+SEGMENT_AUDIO_RATE = 48000
+SEGMENT_AUDIO_CHANNELS = 2
+# AACは区間ごとに先頭へ無音が入り、繋ぐたびに音声がずれるため、
+# 区間の音声はPCMのままmovに書き出し、結合するときに1度だけエンコードする
+SEGMENT_EXT = "mov"
+SEGMENT_AUDIO_CODEC = "pcm_s16le"
+
+
+def _has_time_space(vsml_content: VSMLContent) -> bool:
+    style = vsml_content.style
+    return (
+        style.time_margin_start.is_zero_over()
+        or style.time_margin_end.is_zero_over()
+        or style.time_padding_start.is_zero_over()
+        or style.time_padding_end.is_zero_over()
+    )
+
+
+def get_sequence_second(
+    items: list[VSMLContent],
+    previous_margin_end: TimeValue,
+    has_end_margin: bool,
+) -> float:
+    # シーケンスと同じく、隣り合う余白時間は大きい方だけを数える
+    second = 0.0
+    for item in items:
+        style = item.style
+        second += max(
+            previous_margin_end, style.time_margin_start
+        ).get_second()
+        second += style.get_duration_with_padding().get_second()
+        previous_margin_end = style.time_margin_end
+    if has_end_margin:
+        second += previous_margin_end.get_second()
+    return second
+
+
+def find_segment_path(
+    vsml_content: VSMLContent,
+) -> Optional[list[WrapContent]]:
+    """
+    ルートから子要素が1つのラップ要素を辿り、子要素ごとに分割できるシーケンスまでの経路を返す。
+
+    Parameters
+    ----------
+    vsml_content : VSMLContent
+        ルートの要素
+
+    Returns
+    -------
+    segment_path : Optional[list[WrapContent]]
+        ルートから分割するシーケンスまでのラップ要素のリスト。分割できない場合はNone
+    """
+
+    segment_path = []
+    while isinstance(vsml_content, WrapContent):
+        if _has_time_space(vsml_content):
+            return None
+        segment_path.append(vsml_content)
+        if len(vsml_content.items) == 1:
+            vsml_content = vsml_content.items[0]
+            continue
+        if (
+            vsml_content.style.order != Order.SEQUENCE
+            or len(vsml_content.items) < 2
+        ):
+            return None
+        # 長さが子要素に依存していると、分割した区間の長さが決まらない
+        for item in vsml_content.items:
+            duration = item.style.get_duration()
+            if duration.is_fit() or not duration.has_specific_value():
+                return None
+        # 長さが明示されて子要素の合計と異なる場合も分割しない
+        whole_second = get_sequence_second(
+            vsml_content.items, TimeValue("0"), True
+        )
+        for wrap_content in segment_path:
+            duration = wrap_content.style.get_duration()
+            if abs(duration.get_second() - whole_second) > 1e-6:
+                return None
+        return segment_path
+    return None
+
+
+def get_frame_border(second: float, fps: float) -> int:
+    # 長さの秒数に収まる出力のフレーム数
+    return math.floor(second * fps + 0.5 + 1e-9)
+
+
+def is_frame_border(second: float, fps: float) -> bool:
+    return abs(second * fps - get_frame_border(second, fps)) < 1e-6
+
+
+def split_segment_items(
+    items: list[VSMLContent],
+    segment_count: int,
+    fps: float,
+) -> list[list[VSMLContent]]:
+    # 長さがなるべく均等になるように、連続する子要素をまとめる。
+    # 区切る位置がフレームの途中だと1つのフィルタグラフで出力した場合と
+    # 同じフレームにならないため、フレームの境界になる位置でだけ区切る
+    durations = [
+        item.style.get_duration_with_padding().get_second() for item in items
+    ]
+    whole_duration = sum(durations)
+    segments = []
+    segment_items = []
+    accumulated_duration = 0.0
+    for index, (item, duration) in enumerate(zip(items, durations)):
+        segment_items.append(item)
+        accumulated_duration += duration
+        border = whole_duration * (len(segments) + 1) / segment_count
+        border_second = get_sequence_second(
+            items[: index + 1], TimeValue("0"), False
+        )
+        if (
+            accumulated_duration >= border
+            and len(segments) < segment_count - 1
+            and is_frame_border(border_second, fps)
+        ):
+            segments.append(segment_items)
+            segment_items = []
+    if len(segment_items) > 0:
+        segments.append(segment_items)
+    return segments
+
+
+def create_segment_process(
+    segment_path: list[WrapContent],
+    segment_items: list[VSMLContent],
+    start_margin_second: float,
+    frame_count: int,
+    context: RenderContext,
+    debug_mode: bool = False,
+) -> Process:
+    # 区間ごとに別のffmpegで実行するため、入力ノードを共有しないコンテキストで組み立てる
+    segment_context = context.fork()
+    sequence_content = segment_path[-1]
+    child_processes = []
+    for item in segment_items:
+        child_process = create_process(item, segment_context, debug_mode)
+        if child_process is not None:
+            child_processes.append(child_process)
+    with segment_context.activate():
+        process = create_wrap_process(
+            child_processes, sequence_content, debug_mode
+        )
+        # 1つ前の区間の子要素の終わりの余白時間が長い場合、その差分を先頭に付ける
+        if start_margin_second > 0:
+            process.video, process.audio = time_space_start_filter(
+                TimeValue("{}s".format(start_margin_second)),
+                get_background_color_code(
+                    sequence_content.style.background_color
+                ),
+                process.video,
+                process.audio,
+            )
+        for wrap_content in reversed(segment_path[:-1]):
+            process = create_wrap_process([process], wrap_content, debug_mode)
+    process = adjust_root_process(process, segment_path[0], segment_context)
+
+    # 区間の境目で前後の区間とフレームが重ならないよう、一定のfpsで取り出してフレーム数で切り出す
+    process.video = frame_rate_filter(process.video, segment_context.root_fps)
+    process.video = ffmpeg.trim(process.video, end_frame=frame_count)
+    if process.audio is not None:
+        segment_second = frame_count / segment_context.root_fps
+        process.audio = ffmpeg.filter(
+            process.audio, "apad", whole_dur=segment_second
+        )
+        process.audio = ffmpeg.filter(
+            process.audio, "atrim", end=segment_second
+        )
+    return process
+
+
+def convert_video_by_segments(
+    segment_path: list[WrapContent],
+    out_filename: str,
+    context: RenderContext,
+    debug_mode: bool,
+    overwrite: bool,
+    jobs: int,
+):
+    """
+    シーケンスの子要素を区間に分け、区間ごとのffmpegを並列に実行してから結合する。
+    フィルタグラフの組み立ては順番に行い、エンコードのみをスレッドプールで並列に待つ。
+
+    Parameters
+    ----------
+    segment_path : list[WrapContent]
+        ルートから分割するシーケンスまでのラップ要素のリスト
+    out_filename : str
+        出力する動画のパス
+    context : RenderContext
+        変換のコンテキスト
+    debug_mode : bool
+        デバッグモード
+    overwrite : bool
+        出力ファイルの上書きを許可するか
+    jobs : int
+        同時に実行するffmpegの数
+    """
+
+    output_option = {"pix_fmt": "yuv420p"}
+
+    with tempfile.TemporaryDirectory() as tmp_dir, context.activate():
+        segments = split_segment_items(
+            segment_path[-1].items, jobs, context.root_fps
+        )
+        segment_tasks = []
+        previous_margin_end = TimeValue("0")
+        start_second = 0.0
+        for index, segment_items in enumerate(segments):
+            first_margin_start = segment_items[0].style.time_margin_start
+            start_margin_second = (
+                max(previous_margin_end, first_margin_start).get_second()
+                - first_margin_start.get_second()
+            )
+            segment_second = get_sequence_second(
+                segment_items,
+                previous_margin_end,
+                index == len(segments) - 1,
+            )
+            previous_margin_end = segment_items[-1].style.time_margin_end
+            start_frame = get_frame_border(start_second, context.root_fps)
+            end_frame = get_frame_border(
+                start_second + segment_second, context.root_fps
+            )
+
+            process = create_segment_process(
+                segment_path,
+                segment_items,
+                start_margin_second,
+                end_frame - start_frame,
+                context,
+                debug_mode,
+            )
+            start_second += segment_second
+            segment_filename = os.path.join(
+                tmp_dir, "segment{}.{}".format(index, SEGMENT_EXT)
+            )
+            segment_tasks.append(
+                (process, segment_filename, end_frame - start_frame)
+            )
+
+        exist_audio = any(
+            process.audio is not None for process, _, _ in segment_tasks
+        )
+        if exist_audio:
+            # 区間ごとに音声の有無が変わるとconcatできないため、無音で補う
+            output_option |= {
+                "acodec": SEGMENT_AUDIO_CODEC,
+                "ar": SEGMENT_AUDIO_RATE,
+                "ac": SEGMENT_AUDIO_CHANNELS,
+            }
+            for process, _, frame_count in segment_tasks:
+                if process.audio is None:
+                    process.audio = ffmpeg.filter(
+                        ffmpeg.input("anullsrc", f="lavfi").audio,
+                        "atrim",
+                        end=frame_count / context.root_fps,
+                    )
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    export_video,
+                    process.video,
+                    process.audio,
+                    segment_filename,
+                    context,
+                    debug_mode,
+                    True,
+                    **output_option,
+                    **{"frames:v": frame_count},
+                )
+                for process, segment_filename, frame_count in segment_tasks
+            ]
+            for future in futures:
+                future.result()
+
+        list_filename = os.path.join(tmp_dir, "segments.txt")
+        with open(list_filename, "w") as f:
+            for _, segment_filename, _ in segment_tasks:
+                f.write("file '{}'\n".format(segment_filename))
+        # 映像はそのまま繋ぎ、音声だけを通しでエンコードする
+        concat_option = {"c:v": "copy"}
+        if exist_audio:
+            concat_option["c:a"] = "aac"
+        process = ffmpeg.input(list_filename, f="concat", safe=0).output(
+            out_filename, **concat_option
+        )
+        if debug_mode:
+            print("\n[[[command args]]]\n{}".format(ffmpeg.compile(process)))
+        run_process(process, overwrite, context.progress_callback)
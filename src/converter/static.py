@@ -0,0 +1,149 @@
+import os
+import tempfile
+from typing import Any, Optional
+
+import ffmpeg
+
+from cache import get_cache_dir, get_cache_key, get_cache_path
+from content import SourceContent, VSMLContent, WrapContent
+from style import Order
+from utils import RenderContext, SourceType
+
+from .ffmpeg import duration_filter, get_source_process
+from .incremental import get_subtree_signature
+from .schemas import Process
+
+STILL_CACHE_CATEGORY = "still"
+# 静止画の書き出し方を変えたら古いキャッシュを使わないようにする
+STILL_CACHE_VERSION = 2
+STILL_CACHE_EXT = "mkv"
+# 重ね合わせの結果をピクセル形式ごと劣化させずに保存する
+STILL_VIDEO_OPTION = {"vcodec": "ffv1"}
+# 1枚の画像として読み込んでも、フレームごとに絵が変わりうる形式
+ANIMATED_IMAGE_EXTS = [".gif", ".webp", ".apng"]
+
+
+def is_static_content(vsml_content: VSMLContent) -> bool:
+    style = vsml_content.style
+    if vsml_content.exist_audio or not vsml_content.exist_video:
+        return False
+    # 途中で現れたり消えたりする要素は静止していない
+    if any(
+        time_value.is_zero_over()
+        for time_value in [
+            style.time_margin_start,
+            style.time_margin_end,
+            style.time_padding_start,
+            style.time_padding_end,
+        ]
+    ):
+        return False
+    if isinstance(vsml_content, SourceContent):
+        match vsml_content.type:
+            case SourceType.IMAGE:
+                ext = os.path.splitext(vsml_content.src_path)[1].lower()
+                return ext not in ANIMATED_IMAGE_EXTS
+            case SourceType.TEXT:
+                return True
+            case _:
+                return False
+    elif isinstance(vsml_content, WrapContent):
+        if style.order != Order.PARALLEL:
+            return False
+        for item in vsml_content.items:
+            # 親より先に終わる子要素があると、その時点で絵が変わる
+            if not (
+                item.style.duration.is_fit()
+                or (
+                    style.duration.has_specific_value()
+                    and item.style.duration.has_specific_value()
+                    and item.style.duration.get_second()
+                    >= style.duration.get_second()
+                )
+            ):
+                return False
+            if not is_static_content(item):
+                return False
+        return True
+    else:
+        raise Exception()
+
+
+def find_static_subtrees(vsml_content: VSMLContent) -> list[WrapContent]:
+    """
+    長さの間ずっと同じ絵を出す、画像とテキストだけからなる並列要素を探す。
+    見つかった要素の子孫は探さず、いちばん外側の要素だけを返す。
+
+    Parameters
+    ----------
+    vsml_content : VSMLContent
+        探し始める要素
+
+    Returns
+    -------
+    static_subtrees : list[WrapContent]
+        1枚の静止画にまとめられる要素のリスト
+    """
+
+    if not isinstance(vsml_content, WrapContent):
+        return []
+    if (
+        vsml_content.style.order == Order.PARALLEL
+        and len(vsml_content.items) > 0
+        and is_static_content(vsml_content)
+    ):
+        return [vsml_content]
+    static_subtrees = []
+    for item in vsml_content.items:
+        static_subtrees.extend(find_static_subtrees(item))
+    return static_subtrees
+
+
+def get_static_still_path(
+    vsml_content: WrapContent, context: RenderContext
+) -> Optional[str]:
+    signature = get_subtree_signature(vsml_content)
+    if signature is None:
+        return None
+    cache_key = get_cache_key(
+        STILL_CACHE_VERSION,
+        context.root_resolution.get_str(),
+        signature,
+    )
+    return get_cache_path(STILL_CACHE_CATEGORY, cache_key, STILL_CACHE_EXT)
+
+
+def get_static_still_render_process(
+    process: Process, still_path: str
+) -> tuple[Any, str]:
+    # 書きかけの画像を他の実行が読まないよう、一時ファイルに書き出して後で置き換える
+    os.makedirs(get_cache_dir(STILL_CACHE_CATEGORY), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(still_path),
+        suffix=".{}".format(STILL_CACHE_EXT),
+    )
+    os.close(fd)
+    output_process = ffmpeg.output(
+        process.video, tmp_path, vframes=1, **STILL_VIDEO_OPTION
+    )
+    return output_process, tmp_path
+
+
+def get_static_still_process(
+    vsml_content: VSMLContent, context: RenderContext
+) -> Optional[Process]:
+    still_path = context.static_still_paths.get(id(vsml_content))
+    if still_path is None:
+        return None
+    style = vsml_content.style
+    with context.activate():
+        source = get_source_process(still_path, True, False)
+        # 1フレームだけの静止画を、長さの間繰り返す
+        video_process = ffmpeg.filter(
+            source["video"], "loop", loop=-1, size=1, start=0
+        )
+        if style.duration.has_specific_value():
+            video_process, _ = duration_filter(
+                style.duration, video_process=video_process
+            )
+    return Process(video_process, None, style)
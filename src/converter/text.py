@@ -0,0 +1,167 @@
+import io
+from typing import Optional
+
+from PIL import Image, ImageDraw
+
+from cache import find_file_cache, get_cache_key, save_file_cache
+from probe import get_source_fingerprint
+from style import Color
+from style.utils import load_font
+
+TEXT_CACHE_CATEGORY = "text"
+# 描画の仕方を変えたら古い画像を使わないようにする
+TEXT_CACHE_VERSION = 1
+TEXT_CACHE_EXT = "png"
+# drawtextの既定の色に合わせる
+DEFAULT_FONT_COLOR = (0, 0, 0, 255)
+DEFAULT_BORDER_COLOR = (0, 0, 0, 255)
+
+
+def get_color_tuple(color: Color) -> tuple[int, int, int, int]:
+    return (color.r_value, color.g_value, color.b_value, color.a_value)
+
+
+def draw_text_image(
+    sentence: str,
+    width: int,
+    height: int,
+    padding_left: int,
+    padding_top: int,
+    background_color: Optional[Color],
+    font_path: str,
+    font_size: int,
+    font_color: Optional[Color],
+    font_border_color: Optional[Color],
+    font_border_width: Optional[int],
+) -> Image.Image:
+    font = load_font(font_path, font_size)
+    border_width = 0 if font_border_width is None else font_border_width
+    text_image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(text_image)
+
+    # calculate_text_sizeと同じく、行ごとの外接矩形を縁取りの幅を空けて積み重ねる
+    y = padding_top + border_width
+    for text_line in sentence.split("\n"):
+        offset_x, offset_y, text_width, text_height = font.getbbox(text_line)
+        draw.text(
+            (padding_left + border_width - offset_x, y - offset_y),
+            text_line,
+            font=font,
+            fill=(
+                DEFAULT_FONT_COLOR
+                if font_color is None
+                else get_color_tuple(font_color)
+            ),
+            stroke_width=border_width,
+            stroke_fill=(
+                DEFAULT_BORDER_COLOR
+                if font_border_color is None
+                else get_color_tuple(font_border_color)
+            ),
+        )
+        y += text_height - offset_y + border_width * 2
+
+    background_image = Image.new(
+        "RGBA",
+        (width, height),
+        (
+            (0, 0, 0, 0)
+            if background_color is None
+            else get_color_tuple(background_color)
+        ),
+    )
+    return Image.alpha_composite(background_image, text_image)
+
+
+def get_text_image_path(
+    sentence: str,
+    width: int,
+    height: int,
+    padding_left: int,
+    padding_top: int,
+    background_color: Optional[Color],
+    font_path: str,
+    font_size: int,
+    font_color: Optional[Color],
+    font_border_color: Optional[Color],
+    font_border_width: Optional[int],
+) -> Optional[str]:
+    """
+    テキストを背景ごと描画したPNG画像のパスを返す。
+    描画に使う値とフォントファイルの指紋をキーにキャッシュし、同じテキストは一度だけ描画する。
+
+    Parameters
+    ----------
+    sentence : str
+        描画するテキスト
+    width : int
+        パディングを含む画像の幅
+    height : int
+        パディングを含む画像の高さ
+    padding_left : int
+        左のパディング
+    padding_top : int
+        上のパディング
+    background_color : Optional[Color]
+        背景色。Noneの場合は透明
+    font_path : str
+        フォントファイルのパス
+    font_size : int
+        フォントサイズ
+    font_color : Optional[Color]
+        文字の色
+    font_border_color : Optional[Color]
+        縁取りの色
+    font_border_width : Optional[int]
+        縁取りの幅
+
+    Returns
+    -------
+    image_path : Optional[str]
+        画像のパス。キャッシュに保存できなかった場合はNone
+    """
+
+    font_fingerprint = get_source_fingerprint(font_path)
+    if font_fingerprint is None:
+        return None
+    cache_key = get_cache_key(
+        TEXT_CACHE_VERSION,
+        sentence,
+        width,
+        height,
+        padding_left,
+        padding_top,
+        None if background_color is None else background_color.value,
+        font_fingerprint,
+        font_size,
+        None if font_color is None else font_color.value,
+        None if font_border_color is None else font_border_color.value,
+        font_border_width,
+    )
+    image_path = find_file_cache(
+        TEXT_CACHE_CATEGORY, cache_key, TEXT_CACHE_EXT
+    )
+    if image_path is not None:
+        return image_path
+
+    image = draw_text_image(
+        sentence,
+        width,
+        height,
+        padding_left,
+        padding_top,
+        background_color,
+        font_path,
+        font_size,
+        font_color,
+        font_border_color,
+        font_border_width,
+    )
+    image_data = io.BytesIO()
+    image.save(image_data, format="PNG")
+    return save_file_cache(
+        TEXT_CACHE_CATEGORY,
+        cache_key,
+        TEXT_CACHE_EXT,
+        image_data.getvalue(),
+    )
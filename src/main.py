@@ -1,7 +1,16 @@
 import json
 
 from args import get_args
-from converter import convert_image_from_frame, convert_video
+from converter import (
+    convert_image_from_frames,
+    convert_video,
+    get_preview_frames,
+)
+from converter.analysis import GraphBudget
+from plan import load_plan, save_plan
+from server import serve
+from style.utils import get_text_cache_info
+from watch import watch
 from xml_parser import parsing_vsml
 
 
@@ -13,8 +22,44 @@ def main():
     # コマンド引数を受け取る
     args = get_args()
 
-    # ファイルのVSMLを解析
-    vsml_data = parsing_vsml(args.filename, args.offline)
+    graph_budget = None
+    if args.graph_budget is not None:
+        graph_budget = GraphBudget(args.graph_budget, args.graph_budget_strict)
+
+    if args.serve:
+        # デーモンとして起動し、変換はHTTPで受け付ける
+        serve(args.port, args.workers, graph_budget)
+        return
+    if args.watch:
+        # 起動したまま、ファイルが変わるたびに出力し直す
+        watch(
+            args.filename,
+            args.offline,
+            args.schema_refresh,
+            args.frame,
+            args.every,
+            args.tile,
+            args.output,
+            args.jobs,
+            args.incremental,
+            args.keep_graph,
+            args.static_stills,
+        )
+        return
+
+    if args.from_plan is not None:
+        # 保存した描画プランを使い、VSMLの解析とスタイルの計算を省く
+        vsml_data = load_plan(args.from_plan)
+    else:
+        # ファイルのVSMLを解析
+        vsml_data = parsing_vsml(
+            args.filename, args.offline, args.schema_refresh
+        )
+    if args.dump_plan is not None:
+        # 描画プランだけを保存し、出力は別の実行に任せる
+        save_plan(vsml_data, args.dump_plan)
+        return
+    vsml_data.context.graph_budget = graph_budget
 
     if args.debug:
         content_str = (
@@ -29,20 +74,29 @@ def main():
         )
         with open("./debug.json", "w") as f:
             f.write(content_str)
+        print(
+            "\n[[[text cache]]]\n{}".format(json.dumps(get_text_cache_info()))
+        )
 
-    if args.frame is None:
+    frames = get_preview_frames(vsml_data, args.frame, args.every)
+    if frames is None:
         # 解析したデータをもとにffmpegで動画を構築
         convert_video(
             vsml_data,
             args.output,
             args.debug,
             args.overwrite,
+            args.jobs,
+            args.incremental,
+            args.keep_graph,
+            args.static_stills,
         )
     else:
-        convert_image_from_frame(
+        convert_image_from_frames(
             vsml_data,
-            args.frame,
+            frames,
             args.output,
+            args.tile,
         )
 
 
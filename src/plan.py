@@ -0,0 +1,156 @@
+import json
+from enum import Enum
+from typing import Any
+
+from content import SourceContent, WrapContent
+from style import (
+    AudioSystem,
+    Color,
+    ColorType,
+    Direction,
+    DirectionInfo,
+    GraphicUnit,
+    GraphicValue,
+    LayerMode,
+    Order,
+    Style,
+    TimeUnit,
+    TimeValue,
+)
+from utils import RenderContext, SourceType, WidthHeight
+from vsml import VSML
+
+# 形式を変えたら古いプランを読み込まないようにする
+PLAN_VERSION = 1
+PLAN_ENUMS: dict[str, type[Enum]] = {
+    enum_class.__name__: enum_class
+    for enum_class in [
+        AudioSystem,
+        ColorType,
+        Direction,
+        GraphicUnit,
+        LayerMode,
+        Order,
+        SourceType,
+        TimeUnit,
+    ]
+}
+# 属性をそのまま保存し、__init__を通さずに復元するクラス
+PLAN_CLASSES: dict[str, type] = {
+    plan_class.__name__: plan_class
+    for plan_class in [
+        Color,
+        DirectionInfo,
+        GraphicValue,
+        SourceContent,
+        Style,
+        TimeValue,
+        WrapContent,
+    ]
+}
+
+
+def value_to_plan(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [value_to_plan(item) for item in value]
+    if isinstance(value, Enum):
+        return {"enum": type(value).__name__, "name": value.name}
+    class_name = type(value).__name__
+    if PLAN_CLASSES.get(class_name) is not type(value):
+        raise Exception("cannot save {} in a plan".format(class_name))
+    return {
+        "class": class_name,
+        "attrs": {
+            key: value_to_plan(attr)
+            for key, attr in vars(value).items()
+            # プレビューで一時的に付ける属性は保存しない
+            if key[:1] != "_"
+        },
+    }
+
+
+def plan_to_value(plan_value: Any) -> Any:
+    if isinstance(plan_value, list):
+        return [plan_to_value(item) for item in plan_value]
+    if not isinstance(plan_value, dict):
+        return plan_value
+    if "enum" in plan_value:
+        return PLAN_ENUMS[plan_value["enum"]][plan_value["name"]]
+    value_class = PLAN_CLASSES[plan_value["class"]]
+    # 計算済みの値を使うため、素材の読み込みやスタイルの計算をし直さない
+    value = value_class.__new__(value_class)
+    for key, attr in plan_value["attrs"].items():
+        setattr(value, key, plan_to_value(attr))
+    return value
+
+
+def vsml_to_plan(vsml_data: VSML) -> dict[str, Any]:
+    """
+    スタイルを計算し終えたVSMLオブジェクトを、JSONで保存できる描画プランにする。
+    プランには要素の木と、各要素の時間や配置、素材のメタデータが含まれる。
+
+    Parameters
+    ----------
+    vsml_data : VSML
+        VSMLオブジェクト
+
+    Returns
+    -------
+    plan : dict[str, Any]
+        描画プラン
+    """
+
+    context = vsml_data.context
+    return {
+        "version": PLAN_VERSION,
+        "root_path": context.root_path,
+        "resolution": context.root_resolution.get_str(),
+        "fps": context.root_fps,
+        "dependency_paths": vsml_data.dependency_paths,
+        "source_meta": vsml_data.source_meta_dict,
+        "content": value_to_plan(vsml_data.content),
+    }
+
+
+def plan_to_vsml(plan: dict[str, Any]) -> VSML:
+    """
+    描画プランからVSMLオブジェクトを復元する。
+    VSMLの解析、素材のメタデータの取得、スタイルの計算はしない。
+
+    Parameters
+    ----------
+    plan : dict[str, Any]
+        vsml_to_planで作った描画プラン
+
+    Returns
+    -------
+    vsml_data : VSML
+        VSMLオブジェクト
+    """
+
+    if plan.get("version") != PLAN_VERSION:
+        raise Exception(
+            "unsupported plan version: {}".format(plan.get("version"))
+        )
+    context = RenderContext(plan["root_path"])
+    context.root_resolution = WidthHeight.from_str(plan["resolution"])
+    context.root_fps = plan["fps"]
+
+    vsml_data = VSML.__new__(VSML)
+    vsml_data.content = plan_to_value(plan["content"])
+    vsml_data.context = context
+    vsml_data.source_meta_dict = plan["source_meta"]
+    vsml_data.dependency_paths = plan["dependency_paths"]
+    return vsml_data
+
+
+def save_plan(vsml_data: VSML, plan_path: str):
+    with open(plan_path, "w") as f:
+        json.dump(vsml_to_plan(vsml_data), f, ensure_ascii=False)
+
+
+def load_plan(plan_path: str) -> VSML:
+    with open(plan_path) as f:
+        return plan_to_vsml(json.load(f))
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from ffmpeg import probe as ffprobe
+
+from cache import get_cache_key, load_json_cache, save_json_cache
+
+PROBE_CACHE_CATEGORY = "probe"
+# ffprobeはプロセス起動待ちが主なのでCPU数より多めに並列化する
+PROBE_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# URLの素材の指紋を取るHEADリクエストを待つ秒数
+FINGERPRINT_TIMEOUT = 10
+
+
+def get_source_fingerprint(src_path: str) -> Optional[str]:
+    """
+    素材ファイルの内容が変わったかを判定するための指紋を返す。
+    ローカルファイルはパス、サイズ、更新時刻から、URLはETagもしくはLast-Modifiedから作る。
+
+    Parameters
+    ----------
+    src_path : str
+        素材ファイルのパスもしくはURL
+
+    Returns
+    -------
+    fingerprint : Optional[str]
+        素材の指紋。取得できない場合はNone
+    """
+
+    if src_path[:4] == "http":
+        import requests
+
+        try:
+            response = requests.head(
+                src_path,
+                allow_redirects=True,
+                timeout=FINGERPRINT_TIMEOUT,
+            )
+        except requests.RequestException:
+            return None
+        validator = response.headers.get(
+            "ETag", response.headers.get("Last-Modified")
+        )
+        if validator is None:
+            return None
+        return get_cache_key(src_path, validator)
+    try:
+        stat = os.stat(src_path)
+    except OSError:
+        return None
+    return get_cache_key(
+        os.path.abspath(src_path), stat.st_size, stat.st_mtime_ns
+    )
+
+
+def probe_source(src_path: str) -> dict:
+    """
+    ffprobeで素材のメタデータを取得する。
+    結果は素材の指紋をキーにディスクへ保存し、内容の変わっていない素材ではffprobeを起動しない。
+
+    Parameters
+    ----------
+    src_path : str
+        素材ファイルのパスもしくはURL
+
+    Returns
+    -------
+    meta : dict
+        ffprobeの出力
+    """
+
+    fingerprint = get_source_fingerprint(src_path)
+    if fingerprint is not None:
+        meta = load_json_cache(PROBE_CACHE_CATEGORY, fingerprint)
+        if meta is not None:
+            return meta
+    meta = ffprobe(src_path)
+    if fingerprint is not None:
+        save_json_cache(PROBE_CACHE_CATEGORY, fingerprint, meta)
+    return meta
+
+
+class SourceProber:
+    """
+    素材のメタデータの取得をスレッドプールで先に始めておき、組み立てで必要になった時点で結果を待つ。
+    """
+
+    executor: ThreadPoolExecutor
+    futures: dict[str, Future]
+
+    def __init__(self) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=PROBE_MAX_WORKERS)
+        self.futures = {}
+
+    def __enter__(self) -> SourceProber:
+        return self
+
+    def __exit__(self, *exc_info):
+        # 不正なファイルで読み込みを中断した場合は、まだ始まっていない取得を取り消す
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, src_path: str):
+        if src_path not in self.futures:
+            self.futures[src_path] = self.executor.submit(
+                probe_source, src_path
+            )
+
+    def get(self, src_path: str) -> Optional[dict]:
+        future = self.futures.get(src_path)
+        return None if future is None else future.result()
+
+    def get_meta_dict(self) -> dict[str, dict]:
+        return {
+            src_path: future.result()
+            for src_path, future in self.futures.items()
+        }
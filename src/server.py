@@ -0,0 +1,363 @@
+import json
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+import ffmpeg
+
+from converter import (
+    convert_image_from_frames,
+    convert_video,
+    get_preview_frames,
+)
+from converter.analysis import GraphBudget
+from xml_parser import parsing_vsml
+
+SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 8765
+# 終わったジョブを残しておく秒数と件数
+FINISHED_JOB_TTL_SECOND = 60 * 60
+MAX_FINISHED_JOBS = 100
+JOB_OPTION_DEFAULT = {
+    "output": None,
+    "frame": None,
+    "every": None,
+    "tile": None,
+    "offline": False,
+    "overwrite": False,
+    "schema_refresh": "auto",
+    "jobs": 1,
+    "incremental": False,
+    "keep_graph": False,
+    "static_stills": False,
+}
+
+
+class RenderJob:
+    """
+    デーモンが受け付けた1件の変換。状態の変化と最新の進捗をイベントとして保持し、購読しているクライアントに流す。
+    """
+
+    id: str
+    filename: str
+    option: dict[str, Any]
+    status: str
+    error: Optional[str]
+    finished_at: Optional[float]
+    # 通し番号とイベントの組。進捗は最新の1件だけを残す
+    events: list[tuple[int, dict[str, Any]]]
+    event_count: int
+    condition: threading.Condition
+
+    def __init__(self, filename: str, option: dict[str, Any]) -> None:
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.option = option
+        self.status = "queued"
+        self.error = None
+        self.finished_at = None
+        self.events = []
+        self.event_count = 0
+        self.condition = threading.Condition()
+
+    def append_event(self, event: dict[str, Any]):
+        self.event_count += 1
+        self.events.append((self.event_count, event))
+        self.condition.notify_all()
+
+    def add_event(self, event: dict[str, Any]):
+        with self.condition:
+            if self.events and "status" not in self.events[-1][1]:
+                # 読まれていない古い進捗は、新しい進捗で置き換える
+                self.events.pop()
+            self.append_event(event)
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        # 購読側が終了を見てから最後のイベントを取りこぼさないよう、同時に更新する
+        with self.condition:
+            self.status = status
+            self.error = error
+            if self.is_finished():
+                self.finished_at = time.monotonic()
+            self.append_event({"status": status, "error": error})
+
+    def is_finished(self) -> bool:
+        return self.status in ["done", "failed"]
+
+    def get_summary(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "option": self.option,
+            "status": self.status,
+            "error": self.error,
+        }
+
+    def wait_events(self, last_count: int) -> tuple[int, list[dict[str, Any]]]:
+        """
+        last_countより後のイベントが来るか、ジョブが終わるまで待つ。
+
+        Parameters
+        ----------
+        last_count : int
+            前回受け取ったイベントの通し番号
+
+        Returns
+        -------
+        event_count : int
+            受け取ったイベントの最後の通し番号
+        events : list[dict[str, Any]]
+            まだ受け取っていないイベント
+        """
+
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.event_count > last_count or self.is_finished()
+            )
+            events = [
+                event for count, event in self.events if count > last_count
+            ]
+            return self.event_count, events
+
+
+def run_job(job: RenderJob, graph_budget: Optional[GraphBudget] = None):
+    job.set_status("running")
+    option = job.option
+    try:
+        vsml_data = parsing_vsml(
+            job.filename, option["offline"], option["schema_refresh"]
+        )
+        context = vsml_data.context
+        context.graph_budget = graph_budget
+        with context.activate():
+            whole_second = vsml_data.content.style.get_duration().get_second()
+
+        def notify_progress(progress: dict[str, str]):
+            event = {
+                "frame": progress.get("frame"),
+                "out_time": progress.get("out_time"),
+                "speed": progress.get("speed"),
+                "progress": progress.get("progress"),
+            }
+            out_time_us = progress.get("out_time_us", "N/A")
+            if out_time_us.isdecimal() and whole_second > 0:
+                event["ratio"] = min(int(out_time_us) / whole_second / 1e6, 1)
+            job.add_event(event)
+
+        context.progress_callback = notify_progress
+        # frameは1つのフレーム番号か、フレーム番号のリストで受け付ける
+        frames = option["frame"]
+        frames = [frames] if isinstance(frames, int) else frames
+        frames = get_preview_frames(vsml_data, frames, option["every"])
+        if frames is None:
+            convert_video(
+                vsml_data,
+                option["output"],
+                False,
+                option["overwrite"],
+                option["jobs"],
+                option["incremental"],
+                option["keep_graph"],
+                option["static_stills"],
+            )
+        else:
+            convert_image_from_frames(
+                vsml_data, frames, option["output"], option["tile"]
+            )
+    except Exception as e:
+        traceback.print_exc()
+        error = "{}: {}".format(type(e).__name__, e)
+        if isinstance(e, ffmpeg.Error) and e.stderr:
+            error += "\n" + e.stderr.decode(errors="replace")
+        job.set_status("failed", error)
+        return
+    job.set_status("done")
+
+
+class RenderServer(ThreadingHTTPServer):
+    """
+    ローカルホストでVSMLの変換を受け付けるHTTPサーバー。
+    インポート済みのモジュール、フォントの索引、XSDを保持したまま、ワーカーのスレッドで変換する。
+    """
+
+    port: int
+    graph_budget: Optional[GraphBudget]
+    jobs: dict[str, RenderJob]
+    jobs_lock: threading.Lock
+    executor: ThreadPoolExecutor
+
+    def __init__(
+        self,
+        port: int,
+        workers: int,
+        graph_budget: Optional[GraphBudget] = None,
+    ) -> None:
+        super().__init__((SERVER_HOST, port), RenderRequestHandler)
+        self.port = port
+        self.graph_budget = graph_budget
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+
+    def prune_jobs(self):
+        # jobs_lockを取った状態で呼ぶ。古いものや多すぎる分の終わったジョブを捨てる
+        now = time.monotonic()
+        finished_jobs = sorted(
+            (job for job in self.jobs.values() if job.finished_at is not None),
+            key=lambda job: job.finished_at or 0,
+        )
+        excess = len(finished_jobs) - MAX_FINISHED_JOBS
+        for i, job in enumerate(finished_jobs):
+            finished_at = job.finished_at or now
+            if i < excess or now - finished_at > FINISHED_JOB_TTL_SECOND:
+                del self.jobs[job.id]
+
+    def submit(self, filename: str, option: dict[str, Any]) -> RenderJob:
+        job = RenderJob(filename, option)
+        with self.jobs_lock:
+            self.prune_jobs()
+            self.jobs[job.id] = job
+        self.executor.submit(run_job, job, self.graph_budget)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[RenderJob]:
+        with self.jobs_lock:
+            self.prune_jobs()
+            return self.jobs.get(job_id)
+
+    def get_jobs(self) -> list[RenderJob]:
+        with self.jobs_lock:
+            self.prune_jobs()
+            return list(self.jobs.values())
+
+    def is_allowed_host(self, host: str) -> bool:
+        return host in [
+            "{}:{}".format(name, self.port)
+            for name in [SERVER_HOST, "localhost"]
+        ]
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server: RenderServer
+
+    def send_json(self, status: HTTPStatus, body: Any):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def is_local_request(self) -> bool:
+        # DNSリバインディングや他のサイトからのリクエストを受け付けないよう、
+        # HostとOriginがこのサーバーを指しているものだけを通す
+        if not self.server.is_allowed_host(self.headers.get("Host", "")):
+            return False
+        origin = self.headers.get("Origin")
+        if origin is None:
+            return True
+        scheme, _, host = origin.partition("://")
+        return scheme == "http" and self.server.is_allowed_host(host)
+
+    def do_POST(self):
+        if not self.is_local_request():
+            self.send_json(HTTPStatus.FORBIDDEN, {"error": "forbidden"})
+            return
+        if self.path != "/jobs":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        # application/jsonはプリフライトが必要なため、他のサイトのフォームからは送れない
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            self.send_json(
+                HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                {"error": "content type must be application/json"},
+            )
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            filename = body["filename"]
+            option = JOB_OPTION_DEFAULT | {
+                key: body[key] for key in JOB_OPTION_DEFAULT if key in body
+            }
+        except (ValueError, KeyError, TypeError):
+            self.send_json(
+                HTTPStatus.BAD_REQUEST,
+                {"error": "request body must be json with filename"},
+            )
+            return
+        job = self.server.submit(filename, option)
+        self.send_json(HTTPStatus.ACCEPTED, job.get_summary())
+
+    def do_GET(self):
+        if not self.is_local_request():
+            self.send_json(HTTPStatus.FORBIDDEN, {"error": "forbidden"})
+            return
+        path_list = self.path.strip("/").split("/")
+        if path_list == ["jobs"]:
+            jobs = self.server.get_jobs()
+            self.send_json(HTTPStatus.OK, [job.get_summary() for job in jobs])
+            return
+        job = (
+            self.server.get_job(path_list[1])
+            if len(path_list) in [2, 3] and path_list[0] == "jobs"
+            else None
+        )
+        if job is None:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+        elif len(path_list) == 2:
+            self.send_json(HTTPStatus.OK, job.get_summary())
+        elif path_list[2] == "progress":
+            self.stream_progress(job)
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    def stream_progress(self, job: RenderJob):
+        # 終わるまで1行1イベントのJSONを書き続け、接続を閉じて終わりを知らせる
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        event_count = 0
+        while True:
+            event_count, events = job.wait_events(event_count)
+            for event in events:
+                self.wfile.write((json.dumps(event) + "\n").encode())
+            self.wfile.flush()
+            if job.is_finished() and event_count >= job.event_count:
+                return
+
+
+def serve(
+    port: int = DEFAULT_SERVER_PORT,
+    workers: int = 1,
+    graph_budget: Optional[GraphBudget] = None,
+):
+    """
+    変換を受け付けるデーモンを起動する。
+
+    Parameters
+    ----------
+    port : int
+        待ち受けるポート番号
+    workers : int
+        同時に実行する変換の数
+    graph_budget : Optional[GraphBudget]
+        各ジョブのフィルタグラフの複雑さの上限
+    """
+
+    with RenderServer(port, workers, graph_budget) as server:
+        print("serving on http://{}:{}".format(SERVER_HOST, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -1,2 +1,3 @@
 from .main import *
+from .selector import *
 from .types import *
@@ -2,10 +2,10 @@ from __future__ import annotations
 
 from typing import Optional
 
-from ffmpeg import probe as ffprobe
 from lxml.etree import _Attrib
 
-from utils import TagInfoTree, VSMLManager
+from probe import probe_source
+from utils import RenderContext, VSMLManager
 
 from .calculator import graphic_calculator, time_calculator
 from .styling_parser import (
@@ -86,7 +86,13 @@ class Style:
         source_value: str,
         style_tree: dict[str, str],
         attrib: _Attrib,
+        source_meta: Optional[dict] = None,
+        context: Optional[RenderContext] = None,
     ) -> None:
+        # 指定がなければ、有効になっているコンテキストのルートの設定を使う
+        if context is None:
+            context = VSMLManager.get_context()
+
         # initializing
         self.duration = TimeValue("fit")
         self.time_margin_start = TimeValue("fit")
@@ -142,6 +148,10 @@ class Style:
             if parent_param.font_style is not None:
                 self.font_style = parent_param.font_style
 
+        # 事前に並列で取得したメタデータがなければここで取得する
+        if tag_name in ["vid", "aud", "img"] and source_meta is None:
+            source_meta = probe_source(source_value)
+
         match tag_name:
             case "cont":
                 self.order = Order.SEQUENCE
@@ -168,12 +178,11 @@ class Style:
                 self.layer_mode = LayerMode.SINGLE
                 self.direction = DirectionInfo("row")
             case "vid":
-                meta = ffprobe(source_value)
                 (
                     duration,
                     meta_video,
                     meta_audio,
-                ) = self._get_info_from_meta(meta)
+                ) = self._get_info_from_meta(source_meta)
                 if duration is None or meta_video is None:
                     raise Exception()
                 self.duration = TimeValue("source")
@@ -194,12 +203,11 @@ class Style:
                     if self.audio_system == AudioSystem.STEREO:
                         self.audio_system = self.audio_system
             case "aud":
-                meta = ffprobe(source_value)
                 (
                     duration,
                     meta_video,
                     meta_audio,
-                ) = self._get_info_from_meta(meta)
+                ) = self._get_info_from_meta(source_meta)
                 if duration is None or meta_audio is None:
                     raise Exception()
                 self.duration = TimeValue("source")
@@ -215,12 +223,11 @@ class Style:
                 if self.audio_system == AudioSystem.STEREO:
                     self.audio_system = self.audio_system
             case "img":
-                meta = ffprobe(source_value)
                 (
                     duration,
                     meta_video,
                     meta_audio,
-                ) = self._get_info_from_meta(meta)
+                ) = self._get_info_from_meta(source_meta)
                 if meta_video is None:
                     raise Exception()
                 width = meta_video["width"]
@@ -469,7 +476,7 @@ class Style:
         )
 
         parent_width = (
-            VSMLManager.get_root_resolution().width
+            context.root_resolution.width
             if parent_param is None
             else (
                 parent_param.width.value
@@ -478,7 +485,7 @@ class Style:
             )
         )
         parent_height = (
-            VSMLManager.get_root_resolution().height
+            context.root_resolution.height
             if parent_param is None
             else (
                 parent_param.height.value
@@ -567,54 +574,3 @@ class Style:
             if (self.height.is_auto() and self.source_height is not None)
             else self.height
         )
-
-
-def pickup_style(
-    style_tree: dict[str, dict[str, str]],
-    tag_name: str,
-    class_name: list[str],
-    id_name: Optional[str],
-    parent_info_tree: Optional[TagInfoTree] = None,
-) -> dict[str, str]:
-    picked_up_style = {}
-    for (
-        selectors,
-        style,
-    ) in style_tree.items():
-        checking_selector = selectors.split(" ")
-        checking_selector.reverse()
-        target_selector = checking_selector.pop(0)
-        match target_selector[0]:
-            case ".":
-                if target_selector[1:] not in class_name:
-                    continue
-            case "#":
-                if target_selector[1:] != id_name:
-                    continue
-            case _:
-                if target_selector != tag_name:
-                    continue
-
-        if len(checking_selector) == 0:
-            picked_up_style |= style
-            continue
-
-        info_tree = parent_info_tree
-        while info_tree:
-            target_selector = checking_selector[0]
-            match target_selector[0]:
-                case ".":
-                    if target_selector[1:] in class_name:
-                        checking_selector.pop(0)
-                case "#":
-                    if target_selector[1:] == id_name:
-                        checking_selector.pop(0)
-                case _:
-                    if target_selector == tag_name:
-                        checking_selector.pop(0)
-            info_tree = info_tree.parent
-
-        if len(checking_selector) == 0:
-            picked_up_style |= style
-            continue
-    return picked_up_style
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+from utils import TagInfoTree
+
+SimpleSelector = tuple[str, str]
+
+
+@dataclass
+class SelectorRule:
+    order: int
+    # 対象要素に近い順に並べた祖先のセレクタ
+    ancestors: list[SimpleSelector]
+    style: dict[str, str]
+
+
+def parse_simple_selector(selector: str) -> SimpleSelector:
+    match selector[0]:
+        case ".":
+            return ("class", selector[1:])
+        case "#":
+            return ("id", selector[1:])
+        case _:
+            return ("tag", selector)
+
+
+def match_simple_selector(
+    simple_selector: SimpleSelector,
+    tag_name: str,
+    class_name: list[str],
+    id_name: Optional[str],
+) -> bool:
+    selector_type, name = simple_selector
+    match selector_type:
+        case "class":
+            return name in class_name
+        case "id":
+            return name == id_name
+        case _:
+            return name == tag_name
+
+
+class SelectorIndex:
+    """
+    VSSのセレクタを一番右の単純セレクタ(タグ、クラス、ID)ごとにまとめた索引。
+    要素ごとに全てのセレクタを調べずに、候補となるルールだけを照合する。
+    """
+
+    rules: dict[SimpleSelector, list[SelectorRule]]
+
+    def __init__(self, style_tree: dict[str, dict[str, str]]) -> None:
+        self.rules = {}
+        for order, (selectors, style) in enumerate(style_tree.items()):
+            simple_selectors = [
+                parse_simple_selector(selector)
+                for selector in selectors.split(" ")
+            ]
+            simple_selectors.reverse()
+            target_selector = simple_selectors.pop(0)
+            self.rules.setdefault(target_selector, []).append(
+                SelectorRule(order, simple_selectors, style)
+            )
+
+    def get_candidates(
+        self,
+        tag_name: str,
+        class_name: list[str],
+        id_name: Optional[str],
+    ) -> list[SelectorRule]:
+        candidates = self.rules.get(("tag", tag_name), [])[:]
+        for one_class_name in set(class_name):
+            candidates += self.rules.get(("class", one_class_name), [])
+        if id_name is not None:
+            candidates += self.rules.get(("id", id_name), [])
+        # 記述順に後のルールで上書きされるよう並べ直す
+        candidates.sort(key=lambda rule: rule.order)
+        return candidates
+
+
+def match_ancestors(
+    ancestors: list[SimpleSelector],
+    parent_info_tree: Optional[TagInfoTree],
+) -> bool:
+    remaining_index = 0
+    info_tree = parent_info_tree
+    while info_tree is not None and remaining_index < len(ancestors):
+        if match_simple_selector(
+            ancestors[remaining_index],
+            info_tree.tag_name,
+            info_tree.class_name,
+            info_tree.id_name,
+        ):
+            remaining_index += 1
+        info_tree = info_tree.parent
+    return remaining_index == len(ancestors)
+
+
+def pickup_style(
+    selector_index: SelectorIndex,
+    tag_name: str,
+    class_name: list[str],
+    id_name: Optional[str],
+    parent_info_tree: Optional[TagInfoTree] = None,
+) -> dict[str, str]:
+    picked_up_style = {}
+    for rule in selector_index.get_candidates(tag_name, class_name, id_name):
+        if match_ancestors(rule.ancestors, parent_info_tree):
+            picked_up_style |= rule.style
+    return picked_up_style
@@ -1,25 +1,152 @@
+import os
 import re
+import subprocess
+import sys
+from functools import cache, lru_cache
 from typing import Optional
 
-from matplotlib import font_manager
 from PIL import ImageFont
 
-font_dict: dict[str, dict[str, str]] = {}
-font_files = font_manager.findSystemFonts(fontpaths=None, fontext="ttf")
-for font_file in font_files:
+from cache import get_cache_key, load_json_cache, save_json_cache
+
+FONT_CACHE_CATEGORY = "font"
+FONT_CACHE_KEY = "index"
+FONT_OBJECT_CACHE_SIZE = 64
+TEXT_SIZE_CACHE_SIZE = 8192
+
+
+def get_font_directories() -> list[str]:
+    # 索引がキャッシュから読めるときにmatplotlibを読み込まないよう、
+    # matplotlib.font_managerが走査するディレクトリをここで並べる
+    home = os.path.expanduser("~")
+    if sys.platform == "win32":
+        return [
+            os.path.join(os.environ.get("WINDIR", "C:\\Windows"), "Fonts"),
+            os.path.join(
+                os.environ.get(
+                    "LOCALAPPDATA", os.path.join(home, "AppData", "Local")
+                ),
+                "Microsoft",
+                "Windows",
+                "Fonts",
+            ),
+            os.path.join(
+                os.environ.get(
+                    "APPDATA", os.path.join(home, "AppData", "Roaming")
+                ),
+                "Microsoft",
+                "Windows",
+                "Fonts",
+            ),
+        ]
+    return [
+        "/usr/X11R6/lib/X11/fonts/TTF/",
+        "/usr/X11/lib/X11/fonts",
+        "/usr/share/fonts/",
+        "/usr/local/share/fonts/",
+        "/usr/lib/openoffice/share/fonts/truetype/",
+        os.path.join(
+            os.environ.get(
+                "XDG_DATA_HOME", os.path.join(home, ".local", "share")
+            ),
+            "fonts",
+        ),
+        os.path.join(home, ".fonts"),
+        "/Library/Fonts/",
+        "/Network/Library/Fonts/",
+        "/System/Library/Fonts/",
+        "/opt/local/share/fonts",
+        os.path.join(home, "Library", "Fonts"),
+    ]
+
+
+def get_font_directories_state() -> list[list]:
+    # フォントの追加・削除で更新時刻が変わるよう、サブディレクトリまで含めて記録する
+    directories_state = []
+    for font_directory in get_font_directories():
+        for dir_path, _, _ in os.walk(font_directory):
+            try:
+                directories_state.append(
+                    [dir_path, os.stat(dir_path).st_mtime_ns]
+                )
+            except OSError:
+                continue
+    return directories_state
+
+
+def get_fontconfig_state() -> Optional[str]:
+    # matplotlibはfontconfigが見つけたフォントも使うため、その一覧も索引の鍵にする
+    if sys.platform == "win32":
+        return None
     try:
-        font_info = font_manager.get_font(font_file)
-    except Exception:
-        continue
-    if not font_dict.get(font_info.family_name):
-        font_dict[font_info.family_name] = {}
-    font_dict[font_info.family_name] |= {
-        font_info.style_name.lower().strip(): font_file
-    }
+        result = subprocess.run(
+            ["fc-list", "--format=%{file}\\n"],
+            capture_output=True,
+            check=True,
+            text=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return get_cache_key(sorted(set(result.stdout.splitlines())))
+
+
+def build_font_dict() -> dict[str, dict[str, str]]:
+    from matplotlib import font_manager
+
+    font_dict: dict[str, dict[str, str]] = {}
+    font_files = font_manager.findSystemFonts(fontpaths=None, fontext="ttf")
+    for font_file in font_files:
+        try:
+            font_info = font_manager.get_font(font_file)
+        except Exception:
+            continue
+        if not font_dict.get(font_info.family_name):
+            font_dict[font_info.family_name] = {}
+        font_dict[font_info.family_name] |= {
+            font_info.style_name.lower().strip(): font_file
+        }
+    return font_dict
+
+
+@cache
+def get_font_dict() -> dict[str, dict[str, str]]:
+    """
+    フォントファミリー名とスタイル名からフォントファイルを引く辞書を返す。
+    フォントファイルの走査は重いため、フォントディレクトリの更新時刻とfontconfigが返すフォントの一覧が
+    変わらない限りキャッシュを使う。
+
+    Returns
+    -------
+    font_dict : dict[str, dict[str, str]]
+        フォントファミリー名ごとの、スタイル名をキーにしたフォントファイルのパス
+    """
+
+    directories_state = get_font_directories_state()
+    fontconfig_state = get_fontconfig_state()
+    font_index = load_json_cache(FONT_CACHE_CATEGORY, FONT_CACHE_KEY)
+    if (
+        font_index is not None
+        and font_index.get("directories") == directories_state
+        and font_index.get("fontconfig") == fontconfig_state
+    ):
+        return font_index["fonts"]
+
+    font_dict = build_font_dict()
+    save_json_cache(
+        FONT_CACHE_CATEGORY,
+        FONT_CACHE_KEY,
+        {
+            "directories": directories_state,
+            "fontconfig": fontconfig_state,
+            "fonts": font_dict,
+        },
+    )
+    return font_dict
 
 
 def get_font_list():
-    return list(font_dict.keys())
+    return list(get_font_dict().keys())
 
 
 def get_bi_font(
@@ -93,7 +220,7 @@ def find_font_files(
     font_names: list[str], bold: bool = False, italic: bool = False
 ) -> Optional[str]:
     for font_name in font_names:
-        font_name_dict = font_dict.get(font_name)
+        font_name_dict = get_font_dict().get(font_name)
         if font_name_dict is None:
             continue
         values = list(font_name_dict.values())
@@ -110,12 +237,18 @@ def find_font_files(
                 return get_regular_font(font_name_dict)
 
 
+@lru_cache(maxsize=FONT_OBJECT_CACHE_SIZE)
+def load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=TEXT_SIZE_CACHE_SIZE)
 def calculate_text_size(
     font_path: Optional[str],
     text: str,
     font_size: int,
     font_border_width: Optional[int],
-):
+) -> tuple[int, int]:
     text_lines = text.split("\n")
     if font_path is None:
         max_width = max(map(len, text_lines)) * font_size
@@ -128,7 +261,7 @@ def calculate_text_size(
             len(text_lines) * one_line_height,
         )
     else:
-        font = ImageFont.truetype(font_path, font_size)
+        font = load_font(font_path, font_size)
 
         text_widths: list[int] = []
         text_heights: list[int] = []
@@ -147,3 +280,26 @@ def calculate_text_size(
             height += font_border_width * 2 * len(text_lines)
 
         return width, height
+
+
+def get_text_cache_info() -> dict[str, dict[str, int]]:
+    """
+    フォントオブジェクトとテキストサイズのキャッシュのヒット・ミス数を返す。
+
+    Returns
+    -------
+    cache_info : dict[str, dict[str, int]]
+        キャッシュごとのhits, misses, currsize
+    """
+
+    return {
+        name: {
+            "hits": info.hits,
+            "misses": info.misses,
+            "currsize": info.currsize,
+        }
+        for name, info in (
+            ("font", load_font.cache_info()),
+            ("text_size", calculate_text_size.cache_info()),
+        )
+    }
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from converter.analysis import GraphBudget
 
 
 @dataclass
@@ -13,36 +18,125 @@ class TagInfoTree:
     parent: Optional[TagInfoTree]
 
 
-class VSMLManager:
+current_render_context: ContextVar[Optional[RenderContext]] = ContextVar(
+    "current_render_context", default=None
+)
+
+
+class RenderContext:
+    """
+    1回の変換で使うルートの設定と、フィルタグラフの組み立て中に使い回すノードを保持する。
+    変換ごとに作るので、同じプロセスで複数のフィルタグラフを並行して組み立てられる。
+    """
+
     root_path: str
-    root_resolution: WidthHeight
-    root_fps: float
+    _root_resolution: Optional[WidthHeight]
+    _root_fps: Optional[float]
+    # 入力ごとにsplitのノードと、そこから取り出した出力の数
+    background_processes: dict[str, dict[str, Any]]
+    source_processes: dict[str, dict[str, Any]]
+    # キャッシュ済みのサブツリーの中間ファイルのパス
+    cached_subtree_paths: dict[int, str]
+    # 1枚の静止画にまとめたサブツリーの画像のパス
+    static_still_paths: dict[int, str]
+    # ffmpegの-progressの出力を受け取る関数
+    progress_callback: Optional[Callable[[dict[str, str]], None]]
+    # フィルタグラフの複雑さの上限
+    graph_budget: Optional[GraphBudget]
+
+    def __init__(self, root_path: str = "") -> None:
+        self.root_path = root_path
+        self._root_resolution = None
+        self._root_fps = None
+        self.background_processes = {}
+        self.source_processes = {}
+        self.cached_subtree_paths = {}
+        self.static_still_paths = {}
+        self.progress_callback = None
+        self.graph_budget = None
+
+    @property
+    def root_resolution(self) -> WidthHeight:
+        if self._root_resolution is None:
+            raise Exception(
+                "root resolution is not set; "
+                "run inside RenderContext.activate()"
+            )
+        return self._root_resolution
+
+    @root_resolution.setter
+    def root_resolution(self, resolution: WidthHeight):
+        self._root_resolution = resolution
+
+    @property
+    def root_fps(self) -> float:
+        if self._root_fps is None:
+            raise Exception(
+                "root fps is not set; run inside RenderContext.activate()"
+            )
+        return self._root_fps
+
+    @root_fps.setter
+    def root_fps(self, root_fps: float):
+        self._root_fps = root_fps
+
+    def fork(self) -> RenderContext:
+        # 設定は引き継ぎ、別のフィルタグラフ用にノードのキャッシュだけを空にする
+        context = RenderContext(self.root_path)
+        context._root_resolution = self._root_resolution
+        context._root_fps = self._root_fps
+        context.cached_subtree_paths = self.cached_subtree_paths
+        context.static_still_paths = self.static_still_paths
+        context.progress_callback = self.progress_callback
+        context.graph_budget = self.graph_budget
+        return context
+
+    @contextmanager
+    def activate(self) -> Iterator[RenderContext]:
+        token = current_render_context.set(self)
+        try:
+            yield self
+        finally:
+            current_render_context.reset(token)
+
+
+class VSMLManager:
+    @staticmethod
+    def get_context() -> RenderContext:
+        # 共有の状態に黙って読み書きしないよう、有効なコンテキストがなければエラーにする
+        context = current_render_context.get()
+        if context is None:
+            raise Exception(
+                "no active render context; "
+                "run inside RenderContext.activate()"
+            )
+        return context
 
     @staticmethod
     def set_root_path(root_path: str):
-        VSMLManager.root_path = root_path
+        VSMLManager.get_context().root_path = root_path
 
     @staticmethod
     def get_root_path() -> str:
-        return VSMLManager.root_path
+        return VSMLManager.get_context().root_path
 
     @staticmethod
     def set_root_resolution(
         resolution: WidthHeight,
     ):
-        VSMLManager.root_resolution = resolution
+        VSMLManager.get_context().root_resolution = resolution
 
     @staticmethod
     def get_root_resolution() -> WidthHeight:
-        return VSMLManager.root_resolution
+        return VSMLManager.get_context().root_resolution
 
     @staticmethod
     def set_root_fps(root_fps: float):
-        VSMLManager.root_fps = root_fps
+        VSMLManager.get_context().root_fps = root_fps
 
     @staticmethod
     def get_root_fps() -> float:
-        return VSMLManager.root_fps
+        return VSMLManager.get_context().root_fps
 
 
 class WidthHeight:
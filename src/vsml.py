@@ -1,19 +1,33 @@
-from typing import Optional
+from __future__ import annotations
+
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
 
 from lxml.etree import _Element
 
 import definition
-from content import SourceContent, VSMLContent, WrapContent, get_source_value
+from content import (
+    SourceContent,
+    VSMLContent,
+    WrapContent,
+    get_source_path,
+    get_source_value,
+)
+from probe import SourceProber
 from style import (
     GraphicValue,
     LayerMode,
     Order,
+    SelectorIndex,
     Style,
     TimeValue,
     pickup_style,
 )
-from utils import TagInfoTree, VSMLManager, WidthHeight
-from vss import convert_prop_val_to_dict, convert_vss_dict
+from utils import RenderContext, TagInfoTree, WidthHeight
+from vss import convert_prop_val_to_dict, convert_vss_dict, convert_vss_file
+
+# 素材のメタデータの取得を先に始めておくため、組み立てより先に読んでおくイベントの数
+SOURCE_PREFETCH_EVENTS = 256
 
 
 class WrapObjectTimeInfo:
@@ -53,48 +67,159 @@ class WrapObjectGraphicInfo:
 
 class VSML:
     content: VSMLContent
+    context: RenderContext
+    source_meta_dict: dict[str, dict]
+    # 変更を監視するべき外部スタイルシートと素材のパス
+    dependency_paths: list[str]
 
-    def __init__(self, vsml: _Element, is_offline: bool):
-        # meta, contentの取得
-        children = list(vsml)
-        metaElement, contentElement = (
-            (None, children[0]) if len(children) == 1 else children
-        )
+    def __init__(
+        self,
+        vsml_events: Iterable[tuple[str, _Element]],
+        is_offline: bool,
+        source_prober: SourceProber,
+        context: RenderContext,
+    ):
+        """
+        iterparseのイベントを順に受け取り、要素が閉じるごとにVSMLContentを組み立てる。
+        組み立て終わった要素は解放するため、メモリ使用量は木の深さに比例する。
+
+        Parameters
+        ----------
+        vsml_events : Iterable[tuple[str, _Element]]
+            iterparseが返すstart, endのイベント
+        is_offline : bool
+            オフラインモードかどうか
+        source_prober : SourceProber
+            素材のメタデータを取得するオブジェクト。先読みしたイベントの素材から取得を始める
+        context : RenderContext
+            変換のコンテキスト。ルートの解像度とfpsが設定される
+        """
 
         style_tree = {}
-        # metaデータの操作
-        if metaElement is not None:
-            style_tree = element_to_style(metaElement)
+        selector_index = SelectorIndex(style_tree)
+        builders: list[WrapContentBuilder] = []
+        content = None
+        dependency_paths = []
+
+        for event, vsml_element in prefetch_source_meta(
+            vsml_events, is_offline, source_prober
+        ):
+            tag_name = vsml_element.tag
+            if event == "start":
+                if tag_name == "cont":
+                    # contentデータの操作
+                    context.root_resolution = WidthHeight.from_str(
+                        vsml_element.attrib["resolution"]
+                    )
+                    context.root_fps = float(vsml_element.attrib["fps"])
+                    selector_index = SelectorIndex(style_tree)
+                if tag_name in definition.WRAP_TAG:
+                    parent_builder = builders[-1] if builders else None
+                    builders.append(
+                        WrapContentBuilder(
+                            vsml_element,
+                            selector_index,
+                            parent_builder,
+                            context,
+                        )
+                    )
+                continue
+
+            if tag_name == "meta":
+                # metaデータの操作
+                style_tree = element_to_style(vsml_element, context)
+                dependency_paths += get_stylesheet_paths(vsml_element, context)
+            elif tag_name in definition.CONTENT_TAG:
+                builders[-1].add_child(
+                    create_source_content(
+                        vsml_element,
+                        selector_index,
+                        is_offline,
+                        source_prober,
+                        builders[-1],
+                        context,
+                    )
+                )
+            elif tag_name in definition.WRAP_TAG:
+                wrap_content = builders.pop().finish()
+                if builders:
+                    builders[-1].add_child(wrap_content)
+                else:
+                    content = wrap_content
+            else:
+                # txtの中のbrなどは親要素の処理が終わるまで残しておく
+                continue
+            release_element(vsml_element)
 
-        # contentデータの操作
-        VSMLManager.set_root_resolution(
-            WidthHeight.from_str(contentElement.attrib["resolution"])
-        )
-        VSMLManager.set_root_fps(float(contentElement.attrib["fps"]))
-        content = element_to_content(contentElement, style_tree, is_offline)
         if content is None:
             raise Exception()
+        source_meta_dict = source_prober.get_meta_dict()
+        dependency_paths += [
+            src_path for src_path in source_meta_dict if src_path[:4] != "http"
+        ]
         self.content = content
+        self.context = context
+        self.source_meta_dict = source_meta_dict
+        self.dependency_paths = dependency_paths
+
+
+def release_element(vsml_element: _Element):
+    # 処理済みの要素と、それより前の兄弟要素をlxmlの木から外す
+    vsml_element.clear(keep_tail=True)
+    parent_element = vsml_element.getparent()
+    if parent_element is not None:
+        while vsml_element.getprevious() is not None:
+            del parent_element[0]
 
 
 def element_to_style(
     meta_element: _Element,
+    context: RenderContext,
 ) -> dict[str, dict[str, str]]:
     style_tree = {}
     for styleElement in meta_element:
         src_path = styleElement.get("src", None)
         if src_path is not None and src_path != "":
-            with open(
-                VSMLManager.get_root_path() + src_path,
-                "r",
-            ) as style_src:
-                style_tree |= convert_vss_dict(style_src.read())
+            style_tree |= convert_vss_file(context.root_path + src_path)
         else:
             if styleElement.text is not None and styleElement.text != "":
                 style_tree |= convert_vss_dict(styleElement.text)
     return style_tree
 
 
+def get_stylesheet_paths(
+    meta_element: _Element,
+    context: RenderContext,
+) -> list[str]:
+    return [
+        context.root_path + style_element.get("src")
+        for style_element in meta_element
+        if style_element.get("src", "") != ""
+    ]
+
+
+def prefetch_source_meta(
+    vsml_events: Iterable[tuple[str, _Element]],
+    is_offline: bool,
+    source_prober: SourceProber,
+) -> Iterator[tuple[str, _Element]]:
+    # 一定数のイベントを先に読み、その中の素材のメタデータの取得を並列に始めておく
+    pending_events = deque()
+    for event, vsml_element in vsml_events:
+        if event == "start" and vsml_element.tag in ["vid", "aud", "img"]:
+            raw_src_path = vsml_element.get("src", None)
+            # srcのない要素はスキーマの検証でエラーにする
+            if raw_src_path is not None:
+                src_path = get_source_path(raw_src_path)
+                # オフラインでのURL指定はcreate_source_contentでエラーにする
+                if not (is_offline and src_path[:4] == "http"):
+                    source_prober.submit(src_path)
+        pending_events.append((event, vsml_element))
+        if len(pending_events) > SOURCE_PREFETCH_EVENTS:
+            yield pending_events.popleft()
+    yield from pending_events
+
+
 def get_style_from_attribute(style_str: Optional[str]) -> dict[str, str]:
     style_dict = {}
     if style_str is not None:
@@ -103,83 +228,132 @@ def get_style_from_attribute(style_str: Optional[str]) -> dict[str, str]:
     return style_dict
 
 
-def element_to_content(
+def element_to_style_object(
     vsml_element: _Element,
-    style_tree: dict[str, dict[str, str]],
-    is_offline: bool,
-    parent_info_tree: Optional[TagInfoTree] = None,
-    parent_param: Optional[Style] = None,
-) -> VSMLContent:
-    tag_name = vsml_element.tag
-    classes_name = vsml_element.attrib.get("class", "").split(" ")
-    id_name = vsml_element.attrib.get("id")
-    source_value = (
-        get_source_value(vsml_element)
-        if tag_name in definition.CONTENT_TAG
-        else ""
+    selector_index: SelectorIndex,
+    source_value: str,
+    parent_builder: Optional[WrapContentBuilder],
+    context: RenderContext,
+    source_meta: Optional[dict] = None,
+) -> Style:
+    parent_info_tree = (
+        parent_builder.tag_info_tree if parent_builder is not None else None
+    )
+    parent_param = (
+        parent_builder.vsml_content.style
+        if parent_builder is not None
+        else None
     )
-    if is_offline and source_value[:4] == "http" and tag_name != "txt":
-        raise Exception("please turn off offline mode or don't use URL file")
-
-    # styleの取得
     picked_up_style_tree = pickup_style(
-        style_tree,
-        tag_name,
-        classes_name,
-        id_name,
+        selector_index,
+        vsml_element.tag,
+        vsml_element.attrib.get("class", "").split(" "),
+        vsml_element.attrib.get("id"),
         parent_info_tree,
     ) | get_style_from_attribute(vsml_element.attrib.get("style"))
-    style = Style(
-        tag_name,
+    return Style(
+        vsml_element.tag,
         parent_param,
         source_value,
         picked_up_style_tree,
         vsml_element.attrib,
+        source_meta,
+        context,
     )
 
-    # vsml_elementがSourceContentの場合
-    if tag_name in definition.CONTENT_TAG:
-        vsml_content = SourceContent(
+
+def create_source_content(
+    vsml_element: _Element,
+    selector_index: SelectorIndex,
+    is_offline: bool,
+    source_prober: SourceProber,
+    parent_builder: Optional[WrapContentBuilder],
+    context: RenderContext,
+) -> SourceContent:
+    source_value = get_source_value(vsml_element)
+    if is_offline and source_value[:4] == "http" and vsml_element.tag != "txt":
+        raise Exception("please turn off offline mode or don't use URL file")
+
+    # styleの取得
+    style = element_to_style_object(
+        vsml_element,
+        selector_index,
+        source_value,
+        parent_builder,
+        context,
+        source_prober.get(source_value),
+    )
+    return SourceContent(
+        vsml_element,
+        source_value,
+        style,
+    )
+
+
+class WrapContentBuilder:
+    """
+    WrapContentの開始タグでスタイルを決め、子要素が閉じるたびに時間と大きさを積み上げる。
+    """
+
+    vsml_content: WrapContent
+    tag_info_tree: TagInfoTree
+    has_children: bool
+    wrap_object_time_info: WrapObjectTimeInfo
+    wrap_object_horizontal_info: WrapObjectGraphicInfo
+    wrap_object_vertical_info: WrapObjectGraphicInfo
+    calc_duration: Optional[Callable]
+    calc_width: Callable
+    calc_height: Callable
+
+    def __init__(
+        self,
+        vsml_element: _Element,
+        selector_index: SelectorIndex,
+        parent_builder: Optional[WrapContentBuilder],
+        context: RenderContext,
+    ) -> None:
+        tag_name = vsml_element.tag
+        # styleの取得
+        style = element_to_style_object(
             vsml_element,
-            source_value,
-            style,
+            selector_index,
+            "",
+            parent_builder,
+            context,
         )
 
-    # vsml_elementがWrapContentの場合
-    elif tag_name in definition.WRAP_TAG:
-        # 子要素の取得
-        vsml_element_children = list(vsml_element)
-
-        vsml_content = WrapContent(vsml_element, style)
-        tag_info_tree = TagInfoTree(
+        self.vsml_content = WrapContent(vsml_element, style)
+        self.tag_info_tree = TagInfoTree(
             tag_name,
-            classes_name,
-            id_name,
-            parent_info_tree,
+            vsml_element.attrib.get("class", "").split(" "),
+            vsml_element.attrib.get("id"),
+            (
+                parent_builder.tag_info_tree
+                if parent_builder is not None
+                else None
+            ),
         )
+        self.has_children = False
 
-        wrap_object_time_info = WrapObjectTimeInfo(
-            children_is_fit=(
-                style.order == Order.PARALLEL
-                or len(vsml_element_children) == 0
-            ),
+        self.wrap_object_time_info = WrapObjectTimeInfo(
+            children_is_fit=style.order == Order.PARALLEL,
             whole_duration=TimeValue("0"),
             last_time_margin=TimeValue("0"),
         )
-        calc_duration = None
+        self.calc_duration = None
         # 親要素に時間指定がないとき
         if style.duration.is_fit():
             # シーケンス(時間的逐次)
             if style.order == Order.SEQUENCE:
-                calc_duration = calc_catenating_duration
+                self.calc_duration = calc_catenating_duration
             # パラレル(時間的並列)
             elif style.order == Order.PARALLEL:
-                calc_duration = calc_piling_duration
-        wrap_object_horizontal_info = WrapObjectGraphicInfo(
+                self.calc_duration = calc_piling_duration
+        self.wrap_object_horizontal_info = WrapObjectGraphicInfo(
             whole_length=GraphicValue("0"),
             last_margin=GraphicValue("0"),
         )
-        wrap_object_vertical_info = WrapObjectGraphicInfo(
+        self.wrap_object_vertical_info = WrapObjectGraphicInfo(
             whole_length=GraphicValue("0"),
             last_margin=GraphicValue("0"),
         )
@@ -187,14 +361,14 @@ def element_to_content(
             style.order == Order.PARALLEL
             and style.layer_mode == LayerMode.SINGLE
         )
-        calc_width = (
+        self.calc_width = (
             calc_catenating_graphic_length
             if is_single_layer
             and style.direction is not None
             and style.direction.is_row()
             else calc_piling_graphic_length
         )
-        calc_height = (
+        self.calc_height = (
             calc_catenating_graphic_length
             if is_single_layer
             and style.direction is not None
@@ -202,60 +376,63 @@ def element_to_content(
             else calc_piling_graphic_length
         )
 
-        for vsml_element_child in vsml_element_children:
-            # 子要素Elementの作成と配列への追加
-            child_content = element_to_content(
-                vsml_element_child,
-                style_tree,
-                is_offline,
-                tag_info_tree,
-                style,
+    def add_child(self, child_content: VSMLContent):
+        vsml_content = self.vsml_content
+        # 子要素の配列への追加
+        vsml_content.items.append(child_content)
+        self.has_children = True
+
+        # exist情報の更新
+        vsml_content.exist_video = (
+            vsml_content.exist_video or child_content.exist_video
+        )
+        vsml_content.exist_audio = (
+            vsml_content.exist_audio or child_content.exist_audio
+        )
+
+        child_style = child_content.style
+        # 時間計算
+        if self.calc_duration is not None:
+            self.calc_duration(
+                self.wrap_object_time_info,
+                child_style.duration.is_fit(),
+                child_style.time_margin_start,
+                child_style.time_padding_start,
+                child_style.get_duration(),
+                child_style.time_padding_end,
+                child_style.time_margin_end,
             )
-            vsml_content.items.append(child_content)
 
-            # exist情報の更新
-            vsml_content.exist_video = (
-                vsml_content.exist_video or child_content.exist_video
+        # 幅、高さ計算
+        if child_content.exist_video:
+            self.calc_width(
+                self.wrap_object_horizontal_info,
+                child_style.margin_left,
+                child_style.padding_left,
+                child_style.get_width(),
+                child_style.padding_right,
+                child_style.margin_right,
             )
-            vsml_content.exist_audio = (
-                vsml_content.exist_audio or child_content.exist_audio
+            self.calc_height(
+                self.wrap_object_vertical_info,
+                child_style.margin_top,
+                child_style.padding_top,
+                child_style.get_height(),
+                child_style.padding_bottom,
+                child_style.margin_bottom,
             )
 
-            child_style = child_content.style
-            # 時間計算
-            if calc_duration is not None:
-                calc_duration(
-                    wrap_object_time_info,
-                    child_style.duration.is_fit(),
-                    child_style.time_margin_start,
-                    child_style.time_padding_start,
-                    child_style.get_duration(),
-                    child_style.time_padding_end,
-                    child_style.time_margin_end,
-                )
-
-            # 幅、高さ計算
-            if child_content.exist_video:
-                calc_width(
-                    wrap_object_horizontal_info,
-                    child_style.margin_left,
-                    child_style.padding_left,
-                    child_style.get_width(),
-                    child_style.padding_right,
-                    child_style.margin_right,
-                )
-                calc_height(
-                    wrap_object_vertical_info,
-                    child_style.margin_top,
-                    child_style.padding_top,
-                    child_style.get_height(),
-                    child_style.padding_bottom,
-                    child_style.margin_bottom,
-                )
+    def finish(self) -> WrapContent:
+        vsml_content = self.vsml_content
+        style = vsml_content.style
+        wrap_object_time_info = self.wrap_object_time_info
+        # 子要素がなければ時間的長さを持たない
+        if not self.has_children:
+            wrap_object_time_info.children_is_fit = True
 
         wrap_object_time_info.include_last_margin()
-        wrap_object_horizontal_info.include_last_margin()
-        wrap_object_vertical_info.include_last_margin()
+        self.wrap_object_horizontal_info.include_last_margin()
+        self.wrap_object_vertical_info.include_last_margin()
 
         # wrapのdurationがデフォルト値(FIT)かつ、子要素全体が時間的長さを持つ場合
         if (
@@ -267,14 +444,10 @@ def element_to_content(
         if vsml_content.exist_video:
             # 親のwidth, heightを更新
             if style.width.is_auto():
-                style.width = wrap_object_horizontal_info.whole_length
+                style.width = self.wrap_object_horizontal_info.whole_length
             if style.height.is_auto():
-                style.height = wrap_object_vertical_info.whole_length
-
-    else:
-        raise Exception()
-
-    return vsml_content
+                style.height = self.wrap_object_vertical_info.whole_length
+        return vsml_content
 
 
 def calc_catenating_duration(
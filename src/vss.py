@@ -1,64 +1,167 @@
 from __future__ import annotations
 
+import hashlib
 import re
 
+from cache import get_cache_key, load_pickle_cache, save_pickle_cache
 from definition.vss import STYLE_VALUE_PATTERN
 
 SELECTOR_PATTERN = r"(\.|#)?[a-zA-Z0-9_\-]+"
 PROPERTY_PATTERN = r"[a-z\-]+"
 VALUE_PATTERN = r"[^;]+"
-SELECTORS_PATTERN = r"{0}(\s*(,| )\s*{0})*".format(SELECTOR_PATTERN)
 PROP_VAL_PATTERN = r"\s*{}\s*:\s*{}\s*;?\s*".format(
     PROPERTY_PATTERN, VALUE_PATTERN
 )
 
-ONE_VSS_PATTERN = (
-    r"\s*(?P<selectors>{})\s*\{{(?P<properties>({})+)\}}\s*".format(
-        SELECTORS_PATTERN, PROP_VAL_PATTERN
-    )
+COMMENT_REGEX = re.compile(r"/\*.*?\*/", flags=re.S)
+SKIP_REGEX = re.compile(r"(\s+|/\*.*?\*/)*", flags=re.S)
+SELECTOR_REGEX = re.compile(SELECTOR_PATTERN)
+PROPERTY_REGEX = re.compile(PROPERTY_PATTERN)
+# 値の中のコメントは ; や } を含んでいても値の終わりとみなさない
+DECLARATION_VALUE_REGEX = re.compile(
+    r"([^;}/]|/(?!\*)|/\*.*?\*/)*", flags=re.S
 )
-
-VSS_PATTERN = r"^({})*$".format(ONE_VSS_PATTERN)
+PROP_VAL_REGEX = re.compile(PROP_VAL_PATTERN, flags=re.S)
+# 未定義のプロパティは空文字のみ許容する
+EMPTY_VALUE_REGEX = re.compile("", flags=re.IGNORECASE)
+STYLE_VALUE_REGEX = {
+    property: re.compile(pattern, flags=re.IGNORECASE)
+    for property, pattern in STYLE_VALUE_PATTERN.items()
+}
+
+VSS_CACHE_CATEGORY = "vss"
+# パーサーや値の定義が変わったら古いキャッシュを使わないようにする
+VSS_CACHE_VERSION = 2
+VSS_CACHE_SALT = get_cache_key(VSS_CACHE_VERSION, STYLE_VALUE_PATTERN)
+
+
+class VSSTokenizer:
+    """
+    VSSのテキストを先頭から一度だけ走査し、検証しながらルールの辞書を組み立てる。
+    バックトラックしないので、スタイルシートの長さに比例した時間で終わる。
+    """
+
+    vss_text: str
+    position: int
+
+    def __init__(self, vss_text: str) -> None:
+        self.vss_text = vss_text
+        self.position = 0
+
+    def parse(self) -> dict[str, dict[str, str]]:
+        vss_object = {}
+        self._skip()
+        while not self._is_end():
+            selectors = self._read_selectors()
+            self._expect("{")
+            properties = self._read_declarations()
+            self._expect("}")
+            for selector in selectors:
+                vss_object[selector] = properties
+            self._skip()
+        return vss_object
+
+    def _is_end(self) -> bool:
+        return self.position >= len(self.vss_text)
+
+    def _peek(self) -> str:
+        return self.vss_text[self.position : self.position + 1]
+
+    def _skip(self) -> bool:
+        # 空白とコメントを読み飛ばし、読み飛ばしたかどうかを返す
+        start_position = self.position
+        self.position = SKIP_REGEX.match(self.vss_text, self.position).end()
+        return self.position != start_position
+
+    def _read(self, regex: re.Pattern, expected: str) -> str:
+        match_text = regex.match(self.vss_text, self.position)
+        if match_text is None or match_text.end() == self.position:
+            self._raise_error("expected {}".format(expected))
+        self.position = match_text.end()
+        return match_text.group()
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            self._raise_error("expected '{}'".format(char))
+        self.position += 1
+
+    def _read_selectors(self) -> list[str]:
+        selectors = []
+        simple_selectors = [self._read(SELECTOR_REGEX, "selector")]
+        while True:
+            has_space = self._skip()
+            match self._peek():
+                case ",":
+                    self.position += 1
+                    self._skip()
+                    selectors.append(" ".join(simple_selectors))
+                    simple_selectors = [self._read(SELECTOR_REGEX, "selector")]
+                case "{":
+                    selectors.append(" ".join(simple_selectors))
+                    return selectors
+                case _:
+                    if not has_space:
+                        self._raise_error("expected ',', ' ' or '{'")
+                    simple_selectors.append(
+                        self._read(SELECTOR_REGEX, "selector")
+                    )
+
+    def _read_declarations(self) -> dict[str, str]:
+        properties = {}
+        self._skip()
+        if self._peek() == "}":
+            self._raise_error("expected property")
+        while self._peek() != "}":
+            if self._is_end():
+                self._raise_error("expected '}'")
+            prop = self._read(PROPERTY_REGEX, "property")
+            self._skip()
+            self._expect(":")
+            value = self._read_value()
+            properties[prop] = value
+            if self._peek() == ";":
+                self.position += 1
+            elif self._peek() != "}":
+                self._raise_error("expected ';' or '}'")
+            self._skip()
+        return properties
+
+    def _read_value(self) -> str:
+        match_text = DECLARATION_VALUE_REGEX.match(
+            self.vss_text, self.position
+        )
+        value = COMMENT_REGEX.sub("", match_text.group()).strip()
+        if len(value) == 0:
+            self._raise_error("expected value")
+        self.position = match_text.end()
+        return value
+
+    def _raise_error(self, message: str):
+        line = self.vss_text.count("\n", 0, self.position) + 1
+        column = self.position - (
+            self.vss_text.rfind("\n", 0, self.position) + 1
+        )
+        raise Exception(
+            "VSS syntax error at line {}, column {}: {}".format(
+                line, column + 1, message
+            )
+        )
 
 
 def validate_vss(
     vss_text: str,
 ) -> bool:
-    vss_text = re.sub(
-        r"/\*.*?\*/",
-        "",
-        vss_text,
-        flags=re.S,
-    )
-    vss_pattern = re.compile(VSS_PATTERN, flags=re.S)
-    return bool(vss_pattern.fullmatch(vss_text))
+    try:
+        VSSTokenizer(vss_text).parse()
+    except Exception:
+        return False
+    return True
 
 
 def convert_vss_dict(
     vss_text: str,
 ) -> dict[str, dict[str, str]]:
-    vss_object = {}
-
-    if not validate_vss(vss_text):
-        raise Exception()
-
-    vss_pattern = re.compile(ONE_VSS_PATTERN, flags=re.S)
-    for match_text in vss_pattern.finditer(vss_text):
-        selectors_text = match_text.group("selectors").strip()
-        properties_text = match_text.group("properties").strip()
-        properties = {}
-
-        for prop_text in properties_text.split(";"):
-            properties |= convert_prop_val_to_dict(prop_text)
-
-        for selector in selectors_text.split(","):
-            vss_object[
-                re.sub(
-                    r"\s+",
-                    " ",
-                    selector.strip(),
-                )
-            ] = properties
+    vss_object = VSSTokenizer(vss_text).parse()
 
     # propertyごとのvalueのvalidate
     for (
@@ -70,23 +173,46 @@ def convert_vss_dict(
             property,
             value,
         ) in style.items():
-            if (
-                re.fullmatch(
-                    STYLE_VALUE_PATTERN.get(property, ""),
-                    value,
-                    re.IGNORECASE,
-                )
-                is None
-            ):
+            value_regex = STYLE_VALUE_REGEX.get(property, EMPTY_VALUE_REGEX)
+            if value_regex.fullmatch(value) is None:
                 del copy_style[property]
         vss_object[selector] = copy_style
 
     return vss_object
 
 
+def convert_vss_file(
+    file_path: str,
+) -> dict[str, dict[str, str]]:
+    """
+    VSSファイルを読み込み、ルールの辞書に変換する。
+    変換結果はファイルのハッシュをキーにディスクへ保存し、内容が変わっていなければ再利用する。
+
+    Parameters
+    ----------
+    file_path : str
+        VSSファイルのパス
+
+    Returns
+    -------
+    vss_object : dict[str, dict[str, str]]
+        セレクタごとのプロパティの辞書
+    """
+
+    with open(file_path, "rb") as vss_file:
+        vss_bytes = vss_file.read()
+    cache_key = get_cache_key(
+        VSS_CACHE_SALT, hashlib.sha256(vss_bytes).hexdigest()
+    )
+    vss_object = load_pickle_cache(VSS_CACHE_CATEGORY, cache_key)
+    if vss_object is None:
+        vss_object = convert_vss_dict(vss_bytes.decode())
+        save_pickle_cache(VSS_CACHE_CATEGORY, cache_key, vss_object)
+    return vss_object
+
+
 def convert_prop_val_to_dict(prop_val_str: str) -> dict[str, str]:
-    prop_val_pattern = re.compile(PROP_VAL_PATTERN, flags=re.S)
-    if prop_val_pattern.fullmatch(prop_val_str) is not None:
+    if PROP_VAL_REGEX.fullmatch(prop_val_str) is not None:
         prop_text = prop_val_str.strip()
         if len(prop_text) > 0:
             prop, value = [s.strip() for s in prop_text.split(":", 1)]
@@ -0,0 +1,215 @@
+import os
+import time
+import traceback
+from typing import Optional
+
+from converter import (
+    convert_image_from_frames,
+    convert_video,
+    get_preview_frames,
+)
+from probe import probe_source
+from vsml import VSML
+from xml_parser import parsing_vsml
+
+# ファイルの更新を確認する間隔(秒)
+WATCH_INTERVAL = 0.2
+# これを超えて再描画に時間がかかった場合は警告する(秒)
+WATCH_LATENCY_BUDGET = 1.0
+
+FileState = Optional[tuple[int, int]]
+
+
+def get_file_states(file_paths: list[str]) -> dict[str, FileState]:
+    file_states = {}
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            file_states[file_path] = None
+            continue
+        file_states[file_path] = (stat.st_mtime_ns, stat.st_size)
+    return file_states
+
+
+def get_watch_paths(filename: str, vsml_data: VSML) -> list[str]:
+    return list(dict.fromkeys([filename] + vsml_data.dependency_paths))
+
+
+def is_reparse_needed(vsml_data: VSML, changed_paths: list[str]) -> bool:
+    """
+    変更されたファイルから、VSMLを読み込み直す必要があるかを判定する。
+    素材の変更でメタデータ(長さや大きさ)が変わらなければ、読み込んだ木をそのまま使う。
+
+    Parameters
+    ----------
+    vsml_data : VSML
+        読み込み済みのVSMLオブジェクト
+    changed_paths : list[str]
+        変更されたファイルのパス
+
+    Returns
+    -------
+    is_needed : bool
+        読み込み直す必要があるかどうか
+    """
+
+    for changed_path in changed_paths:
+        source_meta = vsml_data.source_meta_dict.get(changed_path)
+        if source_meta is None:
+            # VSMLファイルかスタイルシートが変わった
+            return True
+        try:
+            if probe_source(changed_path) != source_meta:
+                return True
+        except Exception:
+            return True
+    return False
+
+
+def render(
+    vsml_data: VSML,
+    frames: Optional[list[int]],
+    every_second: Optional[float],
+    tile_columns: Optional[int],
+    output_path: Optional[str],
+    jobs: int,
+    incremental: bool,
+    keep_graph: bool,
+    static_stills: bool,
+):
+    # 前回のフィルタグラフのノードを持ち越さないよう、設定だけを引き継いだコンテキストで描画する
+    vsml_data.context = vsml_data.context.fork()
+    # 間隔で指定した場合は、読み込み直した動画の長さでフレームを選び直す
+    preview_frames = get_preview_frames(vsml_data, frames, every_second)
+    if preview_frames is None:
+        convert_video(
+            vsml_data,
+            output_path,
+            False,
+            True,
+            jobs,
+            incremental,
+            keep_graph,
+            static_stills,
+        )
+    else:
+        convert_image_from_frames(
+            vsml_data, preview_frames, output_path, tile_columns
+        )
+
+
+def watch(
+    filename: str,
+    is_offline: bool,
+    schema_refresh: str,
+    frames: Optional[list[int]],
+    every_second: Optional[float],
+    tile_columns: Optional[int],
+    output_path: Optional[str],
+    jobs: int = 1,
+    incremental: bool = False,
+    keep_graph: bool = False,
+    static_stills: bool = False,
+):
+    """
+    VSMLファイルと外部スタイルシート、素材を監視し、変更があるたびにプレビューや動画を出力し直す。
+    読み込んだ木はメモリに残し、必要なときだけ読み込み直す。
+
+    Parameters
+    ----------
+    filename : str
+        VSMLファイルのパス
+    is_offline : bool
+        オフラインモードかどうか
+    schema_refresh : str
+        XSDのキャッシュの更新方針
+    frames : Optional[list[int]]
+        プレビューするフレーム。every_secondもNoneの場合は動画を出力する
+    every_second : Optional[float]
+        この秒数ごとのフレームもプレビューする
+    tile_columns : Optional[int]
+        プレビューをこの列数のコンタクトシートにまとめる
+    output_path : Optional[str]
+        出力するファイルのパス
+    jobs : int
+        同時に実行するffmpegの数
+    incremental : bool
+        サブツリーの中間ファイルのキャッシュを使うかどうか
+    keep_graph : bool
+        フィルタグラフのファイルを残し、内容が変わらなければ再利用するかどうか
+    static_stills : bool
+        変化しない画像とテキストの並列要素を静止画にまとめるかどうか
+    """
+
+    vsml_data = parsing_vsml(filename, is_offline, schema_refresh)
+    render(
+        vsml_data,
+        frames,
+        every_second,
+        tile_columns,
+        output_path,
+        jobs,
+        incremental,
+        keep_graph,
+        static_stills,
+    )
+    watch_paths = get_watch_paths(filename, vsml_data)
+    file_states = get_file_states(watch_paths)
+    print("[watch] watching {} files".format(len(watch_paths)))
+
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            new_file_states = get_file_states(watch_paths)
+            changed_paths = [
+                watch_path
+                for watch_path in watch_paths
+                if new_file_states[watch_path] != file_states[watch_path]
+            ]
+            if len(changed_paths) == 0:
+                continue
+            file_states = new_file_states
+
+            start = time.perf_counter()
+            try:
+                is_reparsed = is_reparse_needed(vsml_data, changed_paths)
+                if is_reparsed:
+                    vsml_data = parsing_vsml(
+                        filename, is_offline, schema_refresh
+                    )
+                render(
+                    vsml_data,
+                    frames,
+                    every_second,
+                    tile_columns,
+                    output_path,
+                    jobs,
+                    incremental,
+                    keep_graph,
+                    static_stills,
+                )
+            except Exception:
+                # 編集途中の不正なファイルでは止めず、前回の木を残して次の変更を待つ
+                traceback.print_exc()
+                continue
+            elapsed = time.perf_counter() - start
+
+            if is_reparsed:
+                watch_paths = get_watch_paths(filename, vsml_data)
+                file_states = get_file_states(watch_paths) | file_states
+            print(
+                "[watch] {} in {:.0f} ms ({})".format(
+                    "reparsed and rendered" if is_reparsed else "rendered",
+                    elapsed * 1000,
+                    ", ".join(changed_paths),
+                )
+            )
+            if elapsed > WATCH_LATENCY_BUDGET:
+                print(
+                    "[watch] warning: over the budget of {:.0f} ms".format(
+                        WATCH_LATENCY_BUDGET * 1000
+                    )
+                )
+    except KeyboardInterrupt:
+        pass
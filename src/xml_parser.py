@@ -1,31 +1,84 @@
+import codecs
+import re
+import sys
+import time
+from functools import cache
+from io import BytesIO
 from os import path
-from typing import Optional
+from typing import BinaryIO, Optional
 
-import requests
 from chardet import UniversalDetector
 from lxml import etree
 
-from utils import VSMLManager
+from cache import get_cache_key, load_json_cache, save_json_cache
+from probe import SourceProber
+from utils import RenderContext
 from vsml import VSML
 
 CONFIG_FILE = "http://vsml.pigeons.house/config/vsml.xsd"
 OFFLINE_CONFIG_FILE = "./config/vsml.xsd"
 
+SCHEMA_CACHE_CATEGORY = "schema"
+# スキーマの形式が変わったらバージョンを上げて別のキャッシュにする
+SCHEMA_CACHE_VERSION = 1
+SCHEMA_CACHE_KEY = get_cache_key(CONFIG_FILE, SCHEMA_CACHE_VERSION)
+SCHEMA_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+# XSDのダウンロードを待つ秒数。超えたらキャッシュか同梱のファイルを使う
+SCHEMA_DOWNLOAD_TIMEOUT = 10
+
+# chardetでの推定に使うファイル先頭のバイト数
+ENCODING_DETECT_SIZE = 64 * 1024
+# UTF-32はUTF-16とBOMの先頭が重なるため先に判定する
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF32_LE, "UTF-32"),
+    (codecs.BOM_UTF32_BE, "UTF-32"),
+    (codecs.BOM_UTF8, "UTF-8"),
+    (codecs.BOM_UTF16_LE, "UTF-16"),
+    (codecs.BOM_UTF16_BE, "UTF-16"),
+]
+XML_DECLARATION_ENCODING_REGEX = re.compile(
+    rb"<\?xml[^>]*?encoding\s*=\s*[\"']([A-Za-z0-9._\-]+)[\"']"
+)
+# 宣言があればlxmlにバイト列のまま渡せるエンコーディング
+LXML_NATIVE_ENCODINGS = ["UTF-16", "UTF-32", "ISO-8859-1", "EUC-JP"]
+
 
 def get_text_encoding(
-    filename: str,
-) -> Optional[str]:
-    with open(filename, "rb") as file:
+    vsml_bytes: bytes,
+) -> tuple[Optional[str], bool]:
+    """
+    BOM、XML宣言、chardetの順にファイルのエンコーディングを判定する。
+    chardetにはファイル先頭の一部のみを渡す。
+
+    Parameters
+    ----------
+    vsml_bytes : bytes
+        VSMLファイルの内容
+
+    Returns
+    -------
+    encoding : Optional[str]
+        エンコーディング名
+    is_declared : bool
+        BOMもしくはXML宣言でエンコーディングが明示されているかどうか
+    """
+
+    for bom, encoding in BOM_ENCODINGS:
+        if vsml_bytes.startswith(bom):
+            return encoding, True
+    declaration = XML_DECLARATION_ENCODING_REGEX.match(vsml_bytes)
+    if declaration is not None:
+        encoding = declaration.group(1).decode().upper()
+    else:
         detector = UniversalDetector()
-        for line in file:
-            detector.feed(line)
-            if detector.done:
-                break
-    detector.close()
-    encoding = detector.result["encoding"]
-    if encoding == "SHIFT_JIS":
+        detector.feed(vsml_bytes[:ENCODING_DETECT_SIZE])
+        detector.close()
+        encoding = detector.result["encoding"]
+        if encoding is not None:
+            encoding = encoding.upper()
+    if encoding in ["SHIFT_JIS", "SHIFT-JIS"]:
         encoding = "CP932"
-    return encoding
+    return encoding, declaration is not None
 
 
 def formatting_xml(
@@ -57,25 +110,118 @@ def formatting_xml(
     return formatted_text
 
 
+def download_xsd_text() -> tuple[Optional[str], bool]:
+    import requests
+
+    try:
+        response = requests.get(CONFIG_FILE, timeout=SCHEMA_DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+    except requests.Timeout:
+        print(
+            "timed out downloading {}, using the cached schema".format(
+                CONFIG_FILE
+            ),
+            file=sys.stderr,
+        )
+        return None, True
+    except requests.RequestException:
+        return None, False
+    return response.text, False
+
+
+def load_schema_cache() -> Optional[dict]:
+    schema_cache = load_json_cache(SCHEMA_CACHE_CATEGORY, SCHEMA_CACHE_KEY)
+    # 途中で壊れたり形式の違うキャッシュは、ないものとして扱う
+    if (
+        not isinstance(schema_cache, dict)
+        or not isinstance(schema_cache.get("fetched_at"), (int, float))
+        or not isinstance(schema_cache.get("xsd"), str)
+    ):
+        return None
+    return schema_cache
+
+
+def get_xsd_text(
+    schema_refresh: str,
+) -> str:
+    """
+    XSDのテキストをローカルのキャッシュから取得する。
+    キャッシュがない、もしくは更新方針に当てはまる場合のみダウンロードする。
+
+    Parameters
+    ----------
+    schema_refresh : str
+        キャッシュの更新方針
+        never: ダウンロードしない
+        auto: キャッシュがないか古い場合のみダウンロードする
+        always: 常にダウンロードする
+
+    Returns
+    -------
+    xsd_text : str
+        XSDのテキスト
+    """
+
+    schema_cache = load_schema_cache()
+    is_expired = (
+        schema_cache is None
+        or time.time() - schema_cache["fetched_at"] > SCHEMA_CACHE_MAX_AGE
+    )
+    if schema_refresh == "always" or (schema_refresh == "auto" and is_expired):
+        xsd_text, is_timeout = download_xsd_text()
+        if xsd_text is not None:
+            save_json_cache(
+                SCHEMA_CACHE_CATEGORY,
+                SCHEMA_CACHE_KEY,
+                {"fetched_at": time.time(), "xsd": xsd_text},
+            )
+            return xsd_text
+        if schema_refresh == "always" and not is_timeout:
+            raise Exception("failed to download {}".format(CONFIG_FILE))
+
+    # ダウンロードしない、できなかった、もしくは待ちきれなかった場合は
+    # 古いキャッシュか同梱のファイルを使う
+    if schema_cache is not None:
+        return schema_cache["xsd"]
+    with open(OFFLINE_CONFIG_FILE, "r") as f:
+        return f.read()
+
+
+@cache
+def compile_xml_schema(xsd_text: str) -> etree.XMLSchema:
+    schema_root = etree.XML(formatting_xml(xsd_text), None)
+    return etree.XMLSchema(schema_root)
+
+
+def get_xml_schema(
+    schema_refresh: str,
+) -> etree.XMLSchema:
+    # 起動したままのデーモンや監視でも更新方針が効くよう、毎回キャッシュを確かめ、
+    # コンパイルした結果だけをXSDの内容ごとに使い回す
+    return compile_xml_schema(get_xsd_text(schema_refresh))
+
+
 def get_parser_with_xsd(
     is_offline: bool,
+    schema_refresh: str = "auto",
 ) -> etree.XMLParser:
     """
     独自XSDファイルを読み込んだetreeのparserオブジェクトを返す
 
+    Parameters
+    ----------
+    is_offline : bool
+        オフラインモードかどうか。オフラインの場合はXSDをダウンロードしない
+    schema_refresh : str
+        XSDのキャッシュの更新方針
+
     Returns
     -------
     parser : XMLParser
         XSD情報を持った、XMLのparser
     """
 
-    if is_offline:
-        with open(OFFLINE_CONFIG_FILE, "r") as f:
-            xsd_text = formatting_xml(f.read())
-    else:
-        xsd_text = formatting_xml(requests.get(CONFIG_FILE).text)
-    schema_root = etree.XML(xsd_text, None)
-    schema = etree.XMLSchema(schema_root)
+    schema = get_xml_schema("never" if is_offline else schema_refresh)
     return etree.XMLParser(
         schema=schema,
         remove_comments=True,
@@ -83,34 +229,65 @@ def get_parser_with_xsd(
     )
 
 
-def get_vsml_text(
+def get_vsml_encoding(
     filename: str,
-) -> str:
+) -> Optional[str]:
+    """
+    VSMLファイルの先頭のみを読み、Pythonでデコードが必要なエンコーディングを返す。
+
+    Parameters
+    ----------
+    filename : str
+        VSMLファイルのパス
+
+    Returns
+    -------
+    encoding : Optional[str]
+        デコードが必要な場合のエンコーディング名。lxmlがバイト列のまま読める場合はNone
     """
-    受け取ったVSMLファイルのパスを開き、テキスト情報を返す。
+
+    with open(filename, "rb") as f:
+        vsml_head = f.read(ENCODING_DETECT_SIZE)
+    encoding, is_declared = get_text_encoding(vsml_head)
+    # 宣言がなければlxmlはUTF-8として読むため、UTF-8互換なものはそのまま渡せる
+    if encoding is None or encoding in ["UTF-8", "ASCII"]:
+        return None
+    if is_declared and encoding in LXML_NATIVE_ENCODINGS:
+        return None
+    return encoding
+
+
+def open_vsml_source(
+    filename: str,
+    encoding: Optional[str],
+) -> BinaryIO:
+    """
+    受け取ったVSMLファイルをetreeに渡すためのバイナリストリームとして開く。
+    デコードが不要な場合はファイルをそのまま開き、lxmlに少しずつ読ませる。
 
     Parameters
     ----------
     filename : str
         VSMLファイルのパス
+    encoding : Optional[str]
+        デコードが必要な場合のエンコーディング名
 
     Returns
     -------
-    vsml_text : str
-        VSMLファイルの整形されたテキスト情報
+    vsml_source : BinaryIO
+        VSMLファイルの内容を読めるストリーム
     """
 
-    encoding = get_text_encoding(filename)
-    with open(
-        filename,
-        "r",
-        encoding=encoding,
-    ) as f:
-        vsml_text = f.read()
-    return formatting_xml(vsml_text)
+    if encoding is None:
+        return open(filename, "rb")
+    with open(filename, "r", encoding=encoding) as f:
+        vsml_text = formatting_xml(f.read())
+    return BytesIO(vsml_text.encode())
 
 
-def parsing_vsml(filename: str, is_offline: bool) -> VSML:
+def parsing_vsml(
+    filename: str, is_offline: bool, schema_refresh: str = "auto"
+) -> VSML:
     """
     受け取ったVSMLファイルのパスを開きVSMLクラスのオブジェクトにする。
 
@@ -118,6 +295,10 @@ def parsing_vsml(filename: str, is_offline: bool) -> VSML:
     ----------
     filename : str
         VSMLファイルのパス
+    is_offline : bool
+        オフラインモードかどうか
+    schema_refresh : str
+        XSDのキャッシュの更新方針
 
     Returns
     -------
@@ -125,15 +306,24 @@ def parsing_vsml(filename: str, is_offline: bool) -> VSML:
         読み込んだファイルから生成したVSMLオブジェクト
     """
 
-    # 入力されたvsmlの読み込み(xsdでのバリデーション付き)
-    parser = get_parser_with_xsd(is_offline)
-    vsml_text = get_vsml_text(filename)
-    vsml_element = etree.fromstring(vsml_text, parser)
-
     # vsmlファイルからの相対パスを想定するため、vsmlのルートパスを取得
     root_path = path.dirname(filename)
     if root_path != "":
         root_path = root_path + "/"
-    VSMLManager.set_root_path(root_path)
+    # 変換ごとにコンテキストを作り、読み込みから出力まで引き回す
+    context = RenderContext(root_path)
 
-    return VSML(vsml_element, is_offline)
+    encoding = get_vsml_encoding(filename)
+    schema = get_xml_schema("never" if is_offline else schema_refresh)
+    with open_vsml_source(
+        filename, encoding
+    ) as vsml_source, SourceProber() as source_prober, context.activate():
+        # 1度の読み込みでxsdのバリデーションをしながら、要素が閉じるごとに組み立てる
+        vsml_events = etree.iterparse(
+            vsml_source,
+            events=("start", "end"),
+            schema=schema,
+            remove_comments=True,
+            remove_blank_text=True,
+        )
+        return VSML(vsml_events, is_offline, source_prober, context)